@@ -1,34 +1,74 @@
 # app.py
+import os
+
 import dash
-from src import etl, graphics, model
+import flask
+from src import graphics, jobs, model, monitoring, registry
 
 
 def create_app():
-    print("➡️ Cargando datos...")
-    df = etl.load_data()
-    print("✅ Datos cargados:", df.shape)
+    print("➡️ Buscando propiedades...")
+    properties = registry.DatasetRegistry.from_environment()
+    print("✅ Propiedades:", properties.names())
+
+    print("➡️ Cargando datos y entrenando modelo de", properties.default(), "...")
+    bundle = properties.get()
+    print("✅ Datos cargados:", bundle.df.shape)
+    print("✅ Modelo listo:", bundle.model.metrics)
 
-    print("➡️ Entrenando / cargando modelo...")
-    ml_model = model.load_model()
-    print("✅ Modelo listo.")
+    # CANCELGUARD_COMPARE_TRAINING=1: compara en memoria vs por bloques
+    # sobre el mismo holdout (entrena dos veces más, solo para diagnóstico)
+    if os.environ.get("CANCELGUARD_COMPARE_TRAINING") == "1":
+        print("➡️ Comparando entrenamiento en memoria y por bloques...")
+        report = model.compare_training_modes(bundle.path)
+        print(model.format_comparison(report))
 
     print("➡️ Creando app de Dash...")
     app = dash.Dash(__name__)
     app.title = "CancelGuard"
 
     print("➡️ Creando layout...")
-    app.layout = graphics.create_layout(df)
+    app.layout = graphics.create_layout(properties)
     print("✅ Layout creado.")
 
     print("➡️ Registrando callbacks...")
-    graphics.register_callbacks(app, df, ml_model)
+    graphics.register_callbacks(app, properties)
     print("✅ Callbacks registrados.")
 
     return app
 
 
-app = create_app()
-server = app.server  # para despliegues futuros
+def register_routes(app):
+    server = app.server
+
+    @server.route("/metrics")
+    def metrics():
+        """Deriva de cada modelo cargado (sumando todos los workers) para Prometheus."""
+        reports = {b.name: app.registry.drift_scores(b.name) for b in app.registry.loaded()}
+        body = monitoring.prometheus_text(reports) + graphics.render_stats.prometheus_text()
+        return body, 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    @server.route("/jobs/<job_id>/download")
+    def download_job(job_id):
+        """Fichero puntuado de un trabajo "score" terminado (se envía desde disco)."""
+        job = jobs.get(job_id)
+        if job is None or job["kind"] != "score" or job["status"] != "done":
+            flask.abort(404)
+        scored = jobs.result(job_id)
+        return flask.send_file(
+            scored["path"],
+            mimetype="text/csv",
+            as_attachment=True,
+            download_name=scored["filename"],
+        )
+
+
+# Los procesos de los pools (forkserver / spawn, ver jobs.process_pool)
+# importan este script como __mp_main__: ahí no se crea otra app
+if __name__ != "__mp_main__":
+    app = create_app()
+    server = app.server  # para despliegues futuros
+    register_routes(app)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+# src/cube.py
+"""
+Índice por categorías para filtrar el dataset sin recorrerlo entero.
+
+Al cargar los datos se guarda, para cada valor de cada columna de
+filtro (hotel, segmento, depósito, tipo de cliente, mes), la lista
+ordenada de filas que lo tienen. Para filtrar por varias columnas se
+unen las listas de los valores elegidos en la columna más selectiva y
+esas filas se comprueban contra el resto de columnas con el código de
+cada fila, así que el coste depende de cuántas filas deja pasar esa
+columna y no del tamaño del dataset ni de las otras listas.
+
+Las agregaciones (histogramas, tasas de cancelación) se hacen después
+sobre arrays numpy ya preparados, indexando solo las filas elegidas.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from . import etl
+
+FILTER_COLUMNS = [
+    "hotel",
+    "market_segment",
+    "deposit_type",
+    "customer_type",
+    "arrival_date_month",
+]
+
+
+def _sorted_categories(col: str, values: pd.Series) -> list:
+    if col == "arrival_date_month":
+        present = set(values.dropna().unique())
+        return [m for m in etl.MONTHS if m in present] + sorted(
+            present - set(etl.MONTHS), key=str
+        )
+    return sorted(values.dropna().unique(), key=str)
+
+
+class CategoryIndex:
+    """
+    Índice de filas por categoría, construido una vez por dataset.
+
+    - categories[col] / codes[col]: valores de la columna (en orden de
+      visualización) y código entero de cada fila (-1 si es nulo). Para
+      las columnas que no son de filtro se calculan al pedirlas por
+      primera vez (ver encode()).
+    - rows[col][valor]: array ordenado de filas con ese valor (solo para
+      las columnas de filtro)
+    - numeric[col]: columna numérica como array float
+    - target: is_canceled como array float (None si no existe)
+    """
+
+    CACHE_SIZE = 16
+
+    def __init__(self, df: pd.DataFrame, filter_columns: list[str] = FILTER_COLUMNS):
+        self._df = df
+        self.n_rows = len(df)
+        self.filter_columns = [c for c in filter_columns if c in df.columns]
+
+        self.categories: dict[str, list] = {}
+        self.codes: dict[str, np.ndarray] = {}
+        self.rows: dict[str, dict] = {}
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        for col in self.filter_columns:
+            codes = self.encode(col)
+            order = np.argsort(codes, kind="stable").astype(np.int32)
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.categories[col]))
+            # las filas con código -1 quedan al principio de order
+            starts = np.concatenate([[0], np.cumsum(counts)]) + (codes < 0).sum()
+            self.rows[col] = {
+                cat: order[starts[i] : starts[i + 1]]
+                for i, cat in enumerate(self.categories[col])
+            }
+
+        self.numeric = {
+            col: df[col].to_numpy(dtype=float)
+            for col in df.select_dtypes(include="number").columns
+        }
+        self.target = self.numeric.get("is_canceled")
+
+    def encode(self, col: str) -> np.ndarray:
+        """
+        Códigos enteros de una columna categórica (se calculan una vez).
+        """
+        codes = self.codes.get(col)
+        if codes is None:
+            cats = _sorted_categories(col, self._df[col])
+            codes = pd.Categorical(self._df[col], categories=cats).codes.astype(np.int32)
+            with self._lock:
+                self.categories[col] = cats
+                self.codes[col] = codes
+        return codes
+
+    def select(self, filters: dict[str, list] | None) -> np.ndarray | None:
+        """
+        Filas que cumplen todos los filtros ({columna: [valores]}).
+
+        Dentro de una columna los valores se combinan con OR y entre
+        columnas con AND. Devuelve None si no hay ningún filtro activo
+        (todas las filas), o un array ordenado de índices.
+        """
+        active = tuple(
+            sorted(
+                (col, tuple(sorted(values, key=str)))
+                for col, values in (filters or {}).items()
+                if values and col in self.rows
+            )
+        )
+        if not active:
+            return None
+
+        with self._lock:
+            if active in self._cache:
+                self._cache.move_to_end(active)
+                return self._cache[active]
+
+        postings = {
+            col: [self.rows[col][v] for v in values if v in self.rows[col]]
+            for col, values in active
+        }
+        first = min(postings, key=lambda col: sum(len(p) for p in postings[col]))
+        if len(postings[first]) == 1:
+            selected = postings[first][0]
+        else:
+            # los valores de una columna son disjuntos: basta con ordenar
+            selected = np.sort(np.concatenate(postings[first] or [np.empty(0, np.int32)]))
+
+        for col, values in active:
+            if col == first or not len(selected):
+                continue
+            # una posición más al final para el código -1 (nulo), que no pasa
+            wanted = np.zeros(len(self.categories[col]) + 1, dtype=bool)
+            wanted[[self.categories[col].index(v) for v in values if v in self.rows[col]]] = True
+            selected = selected[wanted[self.codes[col][selected]]]
+
+        with self._lock:
+            self._cache[active] = selected
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return selected
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memoria de los arrays del índice, incluidos los códigos calculados
+        después de crearlo y las selecciones en caché (no el DataFrame).
+        """
+        with self._lock:
+            codes = list(self.codes.values())
+            cached = list(self._cache.values())
+        nbytes = sum(a.nbytes for a in self.numeric.values())
+        nbytes += sum(a.nbytes for a in codes + cached)
+        nbytes += sum(r.nbytes for rows in self.rows.values() for r in rows.values())
+        return nbytes
+
+    def count(self, rows: np.ndarray | None) -> int:
+        return self.n_rows if rows is None else len(rows)
+
+    def values(self, col: str, rows: np.ndarray | None) -> np.ndarray:
+        values = self.numeric[col]
+        return values if rows is None else values[rows]
+
+    def cancel_rate_by(
+        self, col: str, rows: np.ndarray | None
+    ) -> tuple[list, np.ndarray, np.ndarray]:
+        """
+        Tasa de cancelación y número de filas por categoría de col,
+        solo sobre las filas seleccionadas. Omite categorías vacías.
+        """
+        codes = self.encode(col)
+        if rows is not None:
+            codes = codes[rows]
+        target = self.values("is_canceled", rows)
+        valid = codes >= 0
+        n_cats = len(self.categories[col])
+        counts = np.bincount(codes[valid], minlength=n_cats)
+        canceled = np.bincount(codes[valid], weights=target[valid], minlength=n_cats)
+
+        present = counts > 0
+        rates = canceled[present] / counts[present]
+        cats = [c for c, keep in zip(self.categories[col], present) if keep]
+        return cats, rates, counts[present]
@@ -1,9 +1,15 @@
 # src/etl.py
 import pandas as pd
 from pathlib import Path
+from typing import Iterator
 
 DATA_PATH = Path(__file__).resolve().parents[1] / "hotel_booking.csv"
 
+MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December",
+]
+
 def load_data(path: str | Path = DATA_PATH) -> pd.DataFrame:
     """
     Carga los datos de reservas de hotel y hace una limpieza básica.
@@ -21,3 +27,85 @@ def load_data(path: str | Path = DATA_PATH) -> pd.DataFrame:
     df = df.dropna(how="all")
 
     return df
+
+
+def iter_chunks(
+    path: str | Path = DATA_PATH,
+    columns: list[str] | None = None,
+    chunksize: int = 50_000,
+) -> Iterator[tuple[pd.DataFrame, float]]:
+    """
+    Lee el CSV por bloques sin cargarlo entero en memoria.
+
+    Devuelve tuplas (chunk, avance), donde avance es la fracción
+    aproximada del fichero ya leída (según la posición en bytes).
+    Solo se leen las columnas pedidas que existan en el fichero, y se
+    añade total_nights igual que en load_data().
+    """
+    path = Path(path)
+    total_bytes = max(path.stat().st_size, 1)
+    header = pd.read_csv(path, nrows=0).columns
+
+    usecols = None
+    if columns is not None:
+        wanted = set(columns)
+        if "total_nights" in wanted:
+            wanted |= {"stays_in_weekend_nights", "stays_in_week_nights"}
+        usecols = [c for c in header if c in wanted]
+
+    with open(path, "rb") as fh:
+        for chunk in pd.read_csv(fh, usecols=usecols, chunksize=chunksize):
+            if {"stays_in_weekend_nights", "stays_in_week_nights"}.issubset(
+                chunk.columns
+            ):
+                chunk["total_nights"] = (
+                    chunk["stays_in_weekend_nights"] + chunk["stays_in_week_nights"]
+                )
+            chunk = chunk.dropna(how="all")
+            yield chunk, min(fh.tell() / total_bytes, 1.0)
+
+
+def arrival_dates(df: pd.DataFrame) -> pd.Series:
+    """
+    Fecha de llegada de cada reserva a partir de arrival_date_year,
+    arrival_date_week_number y arrival_date_day_of_month.
+
+    Si existe arrival_date_month (nombre del mes) se usa directamente con
+    el año y el día. Si no, se busca dentro de la semana ISO indicada el
+    día cuyo día del mes coincide. Las filas sin fecha válida quedan
+    como NaT.
+    """
+    year = "arrival_date_year"
+    day = "arrival_date_day_of_month"
+    if "arrival_date_month" in df.columns and {year, day}.issubset(df.columns):
+        month = df["arrival_date_month"].map({m: i + 1 for i, m in enumerate(MONTHS)})
+        return pd.to_datetime(
+            pd.DataFrame({"year": df[year], "month": month, "day": df[day]}),
+            errors="coerce",
+        )
+
+    week = "arrival_date_week_number"
+    if not {year, week, day}.issubset(df.columns):
+        return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+
+    valid = df[[year, week, day]].notna().all(axis=1)
+    parts = df.loc[valid, [year, week, day]].astype(int)
+    # El año es el del calendario: a principios de enero la semana puede
+    # ser la 52/53 del año ISO anterior, y a finales de diciembre la 1
+    # del siguiente
+    iso_year = (
+        parts[year]
+        - ((parts[week] >= 52) & (parts[day] <= 7))
+        + ((parts[week] == 1) & (parts[day] >= 25))
+    )
+    monday = pd.to_datetime(
+        iso_year.astype(str) + "-" + parts[week].astype(str).str.zfill(2) + "-1",
+        format="%G-%V-%u",
+        errors="coerce",
+    )
+    target_day = parts[day].to_numpy()
+    dates = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    for offset in range(7):
+        candidate = monday + pd.Timedelta(days=offset)
+        dates.loc[candidate.index[candidate.dt.day.to_numpy() == target_day]] = candidate
+    return dates
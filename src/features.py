@@ -0,0 +1,242 @@
+# src/features.py
+"""
+Variables categóricas del modelo codificadas como enteros.
+
+CategoryEncoder guarda, por columna, la lista de categorías (su posición
+es el código) y un diccionario valor -> código. Se ajusta una vez al
+entrenar y se serializa junto al modelo, así que en inferencia codificar
+una reserva es una búsqueda en un dict por columna, y un lote se
+codifica de una vez con pd.Categorical. Los valores nulos o que no se
+vieron al entrenar reciben el código -1.
+
+Los meses se codifican en orden de calendario (January = 0), para que
+los cortes del árbol agrupen meses consecutivos; el resto de columnas
+en orden alfabético. Los valores nuevos que aparecen al entrenar por
+bloques se añaden al final sin cambiar los códigos ya asignados.
+
+La matriz de entrenamiento ya codificada se guarda en disco (en
+CANCELGUARD_CACHE_DIR, por defecto .cancelguard/features) con clave el
+hash del CSV: al volver a entrenar con el mismo fichero no hace falta
+leerlo ni codificarlo otra vez. De cada ruta solo se guarda la última
+versión (al cambiar el CSV se borra la anterior), y las entradas que no
+se leen en CACHE_RETENTION_DAYS (CANCELGUARD_CACHE_RETENTION_DAYS, 30
+por defecto) se borran al guardar otra.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from . import etl
+
+CATEGORICAL_FEATURES = [
+    "deposit_type",
+    "market_segment",
+    "customer_type",
+    "arrival_date_month",
+]
+
+CACHE_DIR = Path(
+    os.environ.get(
+        "CANCELGUARD_CACHE_DIR",
+        Path(__file__).resolve().parents[1] / ".cancelguard" / "features",
+    )
+)
+CACHE_RETENTION_DAYS = float(os.environ.get("CANCELGUARD_CACHE_RETENTION_DAYS", "30"))
+
+
+@dataclass
+class CategoryEncoder:
+    """
+    Códigos enteros de las columnas categóricas.
+
+    categories[col][code] es el valor original; lookup[col] es el
+    diccionario inverso.
+    """
+    columns: list[str]
+    categories: dict[str, list] = field(default_factory=dict)
+    lookup: dict[str, dict[Any, int]] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        for col in self.columns:
+            cats = self.categories.setdefault(col, [])
+            if col == "arrival_date_month" and not cats:
+                cats.extend(etl.MONTHS)
+        self.lookup = {
+            col: {v: i for i, v in enumerate(cats)}
+            for col, cats in self.categories.items()
+        }
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, columns: list[str] | None = None) -> CategoryEncoder:
+        """
+        Ajusta el codificador con las columnas de columns que existan en df.
+        """
+        columns = [c for c in (columns or CATEGORICAL_FEATURES) if c in df.columns]
+        encoder = cls(columns)
+        encoder.update(df)
+        return encoder
+
+    def update(self, df: pd.DataFrame) -> None:
+        """
+        Añade al final los valores de df que aún no tienen código.
+        """
+        for col in self.columns:
+            if col not in df.columns:
+                continue
+            lookup = self.lookup[col]
+            new = [v for v in df[col].dropna().unique() if v not in lookup]
+            for value in sorted(new, key=str):
+                lookup[value] = len(self.categories[col])
+                self.categories[col].append(value)
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Matriz n x len(columns) de códigos (float32, como el resto de
+        features). Las columnas que falten en df se codifican como -1.
+        """
+        out = np.full((len(df), len(self.columns)), -1, dtype=np.float32)
+        for j, col in enumerate(self.columns):
+            if col in df.columns:
+                out[:, j] = pd.Categorical(
+                    df[col], categories=self.categories[col]
+                ).codes
+        return out
+
+    def encode_row(self, data: dict[str, Any]) -> list[int]:
+        return [self.lookup[col].get(data.get(col), -1) for col in self.columns]
+
+    def labels(self, col: str, threshold: float, goes_left: bool) -> list:
+        """
+        Categorías que quedan a cada lado de un corte del árbol sobre col.
+        """
+        n_left = int(np.floor(threshold)) + 1
+        cats = self.categories[col]
+        return cats[:n_left] if goes_left else cats[n_left:]
+
+
+# -------------------------------------------------
+# Caché en disco de la matriz de entrenamiento
+# -------------------------------------------------
+_file_hashes: dict[tuple, str] = {}
+_file_hashes_lock = threading.Lock()
+
+
+def dataset_hash(path: str | Path) -> str:
+    """
+    SHA-1 del contenido del CSV. Se recuerda por (ruta, tamaño, fecha de
+    modificación) para no releer el fichero dentro del mismo proceso.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        cached = _file_hashes.get(memo_key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    value = digest.hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = value
+    return value
+
+
+def cache_key(path: str | Path, spec: dict) -> str | None:
+    """
+    Clave de caché para los datos de path codificados según spec (las
+    columnas usadas): "<ruta y spec>-<contenido>". None si el fichero no
+    existe.
+    """
+    if not Path(path).is_file():
+        return None
+    spec = json.dumps(spec, sort_keys=True)
+    slot = hashlib.sha1((spec + str(Path(path).resolve())).encode()).hexdigest()
+    content = hashlib.sha1((spec + dataset_hash(path)).encode()).hexdigest()
+    return f"{slot[:16]}-{content}"
+
+
+def _cache_path(key: str, cache_dir: Path) -> Path:
+    return cache_dir / f"{key}.npz"
+
+
+def load_matrix(
+    key: str | None, cache_dir: Path = CACHE_DIR
+) -> tuple[np.ndarray, np.ndarray, CategoryEncoder] | None:
+    """
+    Devuelve (X, y, encoder) si la clave está en caché, o None.
+    """
+    if key is None or not _cache_path(key, cache_dir).exists():
+        return None
+    try:
+        with np.load(_cache_path(key, cache_dir), allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            X, y = data["X"], data["y"]
+        # la fecha de modificación es la del último uso (ver _expire)
+        os.utime(_cache_path(key, cache_dir))
+    except (OSError, ValueError, KeyError):
+        return None
+    return X, y, CategoryEncoder(meta["columns"], meta["categories"])
+
+
+def save_matrix(
+    key: str | None,
+    X: np.ndarray,
+    y: np.ndarray,
+    encoder: CategoryEncoder,
+    cache_dir: Path = CACHE_DIR,
+) -> None:
+    """
+    Guarda la matriz codificada. Se escribe en un temporal y se renombra
+    para que otro proceso nunca lea un fichero a medias. Si no se puede
+    escribir, se sigue sin caché. Después borra las entradas que ya no
+    sirven (ver _expire).
+    """
+    if key is None:
+        return
+    meta = {"columns": encoder.columns, "categories": encoder.categories}
+    tmp = cache_dir / f"{key}.{os.getpid()}.tmp.npz"
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        np.savez(tmp, X=X, y=y, meta=np.array(json.dumps(meta)))
+        os.replace(tmp, _cache_path(key, cache_dir))
+    except (OSError, TypeError):
+        tmp.unlink(missing_ok=True)
+        return
+    _expire(key, cache_dir)
+
+
+def _expire(
+    key: str, cache_dir: Path, max_age_days: float = CACHE_RETENTION_DAYS
+) -> None:
+    """
+    Borra las versiones anteriores de la misma ruta (mismo prefijo que
+    key) y las entradas que no se han leído en max_age_days. Los
+    temporales de otros procesos se dejan, salvo que sean igual de viejos.
+    """
+    slot = key.split("-")[0]
+    cutoff = time.time() - max_age_days * 86400
+    for path in cache_dir.glob("*.npz"):
+        if path.name == _cache_path(key, cache_dir).name:
+            continue
+        try:
+            replaced = path.name.startswith(f"{slot}-") and not path.name.endswith(
+                ".tmp.npz"
+            )
+            if replaced or path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass  # otro proceso la ha borrado ya
@@ -1,13 +1,27 @@
 # src/graphics.py
+import functools
+import os
+import threading
+import time
+
 import dash
 from dash import dcc, html, Input, Output, State
-import plotly.express as px
+import numpy as np
 import plotly.io as pio
 import pandas as pd
 
+from . import cube, etl, jobs, registry
 from . import model as model_module
+from . import monitoring, portfolio, timeseries
+
+# Dash serializa las respuestas con plotly.io.json: si orjson está
+# instalado lo usamos, que es bastante más rápido que el json estándar.
+try:
+    import orjson  # noqa: F401
 
-pio.templates.default = "plotly_white"
+    pio.json.config.default_engine = "orjson"
+except ImportError:
+    pass
 
 # -------------------------------------------------
 # Mapeo de nombres técnicos -> legibles
@@ -41,15 +55,278 @@ def pretty_label(colname: str) -> str:
     return COLUMN_LABELS.get(colname, colname.replace("_", " ").capitalize())
 
 
+# -------------------------------------------------
+# Figuras ligeras
+# -------------------------------------------------
+# Las figuras se construyen como diccionarios en vez de con plotly
+# express. Así no se incluye en cada respuesta el template completo de
+# plotly_white (varios KB), solo el puñado de estilos suyos que usamos
+# (BASE_LAYOUT), y los histogramas se agregan en el servidor en lugar de
+# enviar cada fila.
+GRID_COLOR = "#EBF0F8"
+BASE_LAYOUT = {
+    "font": {"color": "#2a3f5f"},
+    "paper_bgcolor": "white",
+    "plot_bgcolor": "white",
+    "colorway": ["#636efa", "#EF553B", "#00cc96", "#ab63fa", "#FFA15A"],
+    "hovermode": "closest",
+    "margin": {"l": 60, "r": 20, "t": 60, "b": 60},
+}
+BASE_AXIS = {
+    "gridcolor": GRID_COLOR,
+    "linecolor": GRID_COLOR,
+    "zerolinecolor": GRID_COLOR,
+    "automargin": True,
+}
+
+
+def _compact(values, decimals: int = 4) -> np.ndarray:
+    """
+    Redondea arrays numéricos para que el JSON sea más corto.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return np.round(values, decimals)
+    return values
+
+
+def lean_figure(
+    traces: list[dict],
+    title: str | None = None,
+    xaxis: dict | None = None,
+    yaxis: dict | None = None,
+    **layout,
+) -> dict:
+    fig_layout = {
+        **BASE_LAYOUT,
+        "xaxis": {**BASE_AXIS, **(xaxis or {})},
+        "yaxis": {**BASE_AXIS, **(yaxis or {})},
+        **layout,
+    }
+    if title:
+        fig_layout["title"] = {"text": title}
+    return {"data": traces, "layout": fig_layout}
+
+
+def empty_figure() -> dict:
+    return lean_figure([])
+
+
+def lean_bar(x, y, title: str | None = None, **kwargs) -> dict:
+    trace = {"type": "bar", "x": list(x), "y": _compact(y)}
+    trace.update(kwargs.pop("trace", {}))
+    return lean_figure([trace], title, **kwargs)
+
+
+def lean_line(x, y, title: str | None = None, **kwargs) -> dict:
+    trace = {"type": "scatter", "mode": "lines+markers", "x": list(x), "y": _compact(y)}
+    trace.update(kwargs.pop("trace", {}))
+    return lean_figure([trace], title, **kwargs)
+
+
+def lean_histogram(
+    values: np.ndarray,
+    groups: np.ndarray,
+    nbins: int = 40,
+    title: str | None = None,
+    **kwargs,
+) -> dict:
+    """
+    Histograma superpuesto por grupo, con los conteos calculados aquí.
+
+    Se envían nbins barras por grupo en vez de todos los valores.
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    values, groups = values[valid], np.asarray(groups)[valid]
+    if not len(values):
+        return empty_figure()
+
+    edges = np.histogram_bin_edges(values, bins=nbins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    traces = []
+    for group in np.unique(groups):
+        counts, _ = np.histogram(values[groups == group], bins=edges)
+        traces.append(
+            {
+                "type": "bar",
+                "name": str(group),
+                "x": _compact(centers),
+                "y": counts,
+                "width": float(edges[1] - edges[0]),
+                "opacity": 0.6,
+            }
+        )
+    return lean_figure(traces, title, barmode="overlay", bargap=0, **kwargs)
+
+
+def _collapse_runs(axis: np.ndarray, z: np.ndarray, along: int):
+    """
+    Junta filas/columnas consecutivas idénticas de una rejilla.
+
+    Devuelve los bordes de los tramos que quedan (para un heatmap con
+    celdas de ancho variable) y la rejilla reducida.
+    """
+    diff = np.any(np.diff(z, axis=along) != 0, axis=1 - along)
+    starts = np.concatenate([[0], np.flatnonzero(diff) + 1])
+    step = axis[1] - axis[0] if len(axis) > 1 else 1.0
+    edges = np.concatenate([axis[starts] - step / 2, [axis[-1] + step / 2]])
+    return edges, np.take(z, starts, axis=along)
+
+
+def lean_heatmap(
+    x: np.ndarray,
+    y: np.ndarray,
+    z: np.ndarray,
+    title: str | None = None,
+    **kwargs,
+) -> dict:
+    """
+    Heatmap de una rejilla constante a trozos (como la del árbol).
+
+    Las columnas y filas repetidas se envían una sola vez: con bordes
+    de celda de ancho variable el dibujo es el mismo y el JSON pasa de
+    len(x) * len(y) valores a uno por región.
+    """
+    x_edges, z = _collapse_runs(np.asarray(x, dtype=float), np.asarray(z), along=1)
+    y_edges, z = _collapse_runs(np.asarray(y, dtype=float), z, along=0)
+    trace = {
+        "type": "heatmap",
+        "x": _compact(x_edges, 2),
+        "y": _compact(y_edges, 2),
+        "z": _compact(z, 2),
+    }
+    trace.update(kwargs.pop("trace", {}))
+    return lean_figure([trace], title, **kwargs)
+
+
+# -------------------------------------------------
+# Estadísticas de render (bytes y tiempo de serialización)
+# -------------------------------------------------
+class RenderStats:
+    """
+    Mide, para una de cada sample_every llamadas de cada callback,
+    cuántos bytes ocupa la respuesta y cuánto tarda en serializarse.
+
+    Con sample_every = 0 no se mide nada. Se configura con
+    CANCELGUARD_RENDER_STATS_EVERY (10 por defecto).
+    """
+
+    def __init__(self, sample_every: int):
+        self.sample_every = sample_every
+        self._lock = threading.Lock()
+        self._calls: dict[str, int] = {}
+        self._stats: dict[str, dict[str, float]] = {}
+
+    def _should_sample(self, name: str) -> bool:
+        if self.sample_every <= 0:
+            return False
+        with self._lock:
+            n = self._calls.get(name, 0)
+            self._calls[name] = n + 1
+        return n % self.sample_every == 0
+
+    def record(self, name: str, value) -> None:
+        start = time.perf_counter()
+        payload = pio.json.to_json_plotly(value)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats.setdefault(
+                name, {"samples": 0, "bytes": 0.0, "seconds": 0.0}
+            )
+            stats["samples"] += 1
+            stats["bytes"] += len(payload.encode("utf-8"))
+            stats["seconds"] += elapsed
+
+    def instrument(self, name: str):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                value = func(*args, **kwargs)
+                if self._should_sample(name):
+                    self.record(name, value)
+                return value
+
+            return wrapper
+
+        return decorator
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Media de bytes y de segundos de serialización por callback.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "samples": s["samples"],
+                    "avg_bytes": s["bytes"] / s["samples"],
+                    "avg_serialize_seconds": s["seconds"] / s["samples"],
+                }
+                for name, s in self._stats.items()
+            }
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP cancelguard_callback_payload_bytes Tamaño medio de la respuesta del callback.",
+            "# TYPE cancelguard_callback_payload_bytes gauge",
+            "# HELP cancelguard_callback_serialize_seconds Tiempo medio de serialización JSON.",
+            "# TYPE cancelguard_callback_serialize_seconds gauge",
+        ]
+        for name, s in self.summary().items():
+            lines.append(
+                f'cancelguard_callback_payload_bytes{{callback="{name}"}} {s["avg_bytes"]:.0f}'
+            )
+            lines.append(
+                f'cancelguard_callback_serialize_seconds{{callback="{name}"}} '
+                f'{s["avg_serialize_seconds"]:.6f}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+render_stats = RenderStats(int(os.environ.get("CANCELGUARD_RENDER_STATS_EVERY", "10")))
+
+
 # -------------------------------------------------
 # Pestaña EXPLORACIÓN
 # -------------------------------------------------
-def layout_exploration(df: pd.DataFrame) -> html.Div:
+def layout_exploration(df: pd.DataFrame, index: cube.CategoryIndex) -> html.Div:
     numeric_cols = df.select_dtypes(include="number").columns
     categorical_cols = df.select_dtypes(exclude="number").columns
 
+    filters = [
+        html.Div(
+            [
+                html.Label(f"{pretty_label(col)}:"),
+                dcc.Dropdown(
+                    id=f"filter-{col}",
+                    options=[
+                        {"label": str(v), "value": v}
+                        for v in index.categories.get(col, [])
+                    ],
+                    value=[],
+                    multi=True,
+                    placeholder="Todos",
+                    className="dash-dropdown",
+                ),
+            ],
+            style={
+                "width": "19%",
+                "marginRight": "1%",
+                "display": "inline-block" if col in index.filter_columns else "none",
+            },
+        )
+        for col in cube.FILTER_COLUMNS
+    ]
+
     return html.Div(
         [
+            html.Div(
+                [
+                    html.Div(filters),
+                    html.P(id="filter-summary", className="app-subtitle"),
+                ],
+                className="card",
+            ),
             html.Div(
                 [
                     html.Div(
@@ -103,9 +380,9 @@ def layout_exploration(df: pd.DataFrame) -> html.Div:
 
 
 # -------------------------------------------------
-# Pestaña PREDICCIÓN (solo 4 variables que usa el modelo)
+# Pestaña PREDICCIÓN (las variables numéricas y categóricas del modelo)
 # -------------------------------------------------
-def layout_predictor(df: pd.DataFrame) -> html.Div:
+def predictor_defaults(df: pd.DataFrame) -> tuple[int, int, float]:
     # Medias para valores por defecto
     mean_lead_time = int(df["lead_time"].mean()) if "lead_time" in df.columns else 0
     mean_total_nights = (
@@ -114,6 +391,48 @@ def layout_predictor(df: pd.DataFrame) -> html.Div:
         else 1
     )
     mean_adr = float(df["adr"].mean()) if "adr" in df.columns else 0.0
+    return mean_lead_time, mean_total_nights, mean_adr
+
+
+# Variables categóricas del formulario: las de features.CATEGORICAL_FEATURES
+# entran en el modelo como códigos, y con las de segmento (hotel, etc.) se
+# elige el árbol si el modelo se ha entrenado en modo "segmented"
+CATEGORY_INPUTS = [
+    "hotel",
+    "deposit_type",
+    "market_segment",
+    "customer_type",
+    "arrival_date_month",
+]
+
+
+def predictor_category_defaults(index: cube.CategoryIndex) -> list:
+    # Valor más frecuente de cada columna (None si no existe)
+    defaults = []
+    for col in CATEGORY_INPUTS:
+        rows = index.rows.get(col) or {}
+        defaults.append(max(rows, key=lambda v: len(rows[v])) if rows else None)
+    return defaults
+
+
+def layout_predictor(df: pd.DataFrame, index: cube.CategoryIndex) -> html.Div:
+    mean_lead_time, mean_total_nights, mean_adr = predictor_defaults(df)
+
+    category_inputs = []
+    for col, default in zip(CATEGORY_INPUTS, predictor_category_defaults(index)):
+        category_inputs += [
+            html.Label(f"{pretty_label(col)}:"),
+            dcc.Dropdown(
+                id=f"input-{col}",
+                options=[
+                    {"label": str(v), "value": v}
+                    for v in index.categories.get(col, [])
+                ],
+                value=default,
+                placeholder="Desconocido",
+                className="dash-dropdown",
+            ),
+        ]
 
     return html.Div(
         [
@@ -122,7 +441,9 @@ def layout_predictor(df: pd.DataFrame) -> html.Div:
                     html.H2("Predicción de cancelación de reserva"),
                     html.P(
                         "Introduce las variables clave de la reserva y pulsa «Predecir». "
-                        "El modelo utiliza únicamente estas cuatro variables numéricas.",
+                        "El modelo utiliza cuatro variables numéricas y el depósito, "
+                        "segmento, tipo de cliente y mes de llegada; si hay un árbol "
+                        "propio para el segmento de la reserva, se usa ese.",
                         className="app-subtitle",
                     ),
                 ],
@@ -167,6 +488,7 @@ def layout_predictor(df: pd.DataFrame) -> html.Div:
                         ],
                         className="predict-column",
                     ),
+                    html.Div(category_inputs, className="predict-column"),
                 ],
                 className="card predict-row",
             ),
@@ -183,6 +505,92 @@ def layout_predictor(df: pd.DataFrame) -> html.Div:
                 ],
                 className="card",
             ),
+            html.Div(
+                [
+                    html.H2("¿Qué pasa si cambio la antelación o el precio?"),
+                    html.P(
+                        "Probabilidad de cancelación para distintas combinaciones "
+                        "de antelación y ADR, manteniendo el resto de valores "
+                        "de la última predicción.",
+                        className="app-subtitle",
+                    ),
+                    dcc.Graph(id="sensitivity-heatmap"),
+                ],
+                className="card",
+            ),
+            html.Div(
+                [
+                    html.H2("Deriva de los datos de entrada"),
+                    html.P(
+                        "Compara las reservas puntuadas con las de entrenamiento "
+                        "(PSI y KS por variable). Se actualiza cada 30 segundos.",
+                        className="app-subtitle",
+                    ),
+                    html.Div(id="drift-table"),
+                    dcc.Interval(id="drift-interval", interval=30_000),
+                ],
+                className="card",
+            ),
+            html.Div(
+                [
+                    html.H2("Puntuar un fichero de reservas"),
+                    html.P(
+                        "Sube un CSV exportado del PMS (con las mismas columnas que "
+                        "el histórico, hasta "
+                        f"{jobs.UPLOAD_MAX_BYTES // 2**20} MB). Se puntúa en segundo "
+                        "plano y al terminar puedes descargar una copia con la "
+                        "probabilidad de cancelación de cada reserva (cancel_imputed "
+                        "marca las que tenían valores vacíos). El fichero se guarda "
+                        f"{jobs.RETENTION_HOURS:g} horas.",
+                        className="app-subtitle",
+                    ),
+                    dcc.Upload(
+                        html.Div(["Arrastra el CSV aquí o ", html.A("selecciónalo")]),
+                        id="score-upload",
+                        accept=".csv,text/csv",
+                        max_size=jobs.UPLOAD_MAX_BYTES,
+                        className="upload-box",
+                        style={
+                            "border": "1px dashed #94a3b8",
+                            "borderRadius": "8px",
+                            "padding": "18px",
+                            "textAlign": "center",
+                            "cursor": "pointer",
+                        },
+                    ),
+                    html.Button(
+                        "Cancelar",
+                        id="btn-score-cancel",
+                        n_clicks=0,
+                        style={"marginTop": "12px"},
+                    ),
+                    html.Div(id="score-status"),
+                    dcc.Store(id="score-job"),
+                    dcc.Interval(id="score-poll", interval=1_000, disabled=True),
+                ],
+                className="card",
+            ),
+            html.Div(
+                [
+                    html.H2("Reentrenar el modelo"),
+                    html.P(
+                        "El entrenamiento se ejecuta en segundo plano; puedes seguir "
+                        "usando la aplicación mientras tanto.",
+                        className="app-subtitle",
+                    ),
+                    html.Button("Reentrenar", id="btn-retrain", n_clicks=0),
+                    html.Button(
+                        "Cancelar",
+                        id="btn-retrain-cancel",
+                        n_clicks=0,
+                        style={"marginLeft": "12px"},
+                    ),
+                    html.Div(id="retrain-status"),
+                    dcc.Store(id="retrain-job"),
+                    dcc.Interval(id="retrain-poll", interval=1_000, disabled=True),
+                ],
+                className="card",
+            ),
         ]
     )
 
@@ -190,7 +598,66 @@ def layout_predictor(df: pd.DataFrame) -> html.Div:
 # -------------------------------------------------
 # Pestaña RECOMENDACIONES
 # -------------------------------------------------
-def layout_recommendations(df: pd.DataFrame) -> html.Div:
+def daily_series(bundle: registry.PropertyBundle) -> timeseries.DailySeries:
+    return bundle.aggregate(
+        "daily-series", lambda: timeseries.DailySeries.from_frame(bundle.df)
+    )
+
+
+def daily_figure(series: timeseries.DailySeries, first=None, last=None) -> dict:
+    """
+    Cancelaciones diarias y tasas (diaria, 7 y 28 días) entre first y
+    last, cortando los arrays ya calculados de la serie.
+    """
+    day0, cols = series.window(first, last)
+    if not len(cols.get("bookings", ())):
+        return empty_figure()
+
+    days = {"x0": f"{day0:%Y-%m-%d}", "dx": 86_400_000}
+    rates = [
+        ("rate", "Tasa diaria", {"color": "#cbd5e1", "width": 1}),
+        ("rate_7d", "Tasa 7 días", {"color": "#636efa"}),
+        ("rate_28d", "Tasa 28 días", {"color": "#ef553b"}),
+    ]
+    return lean_figure(
+        [
+            {
+                "type": "bar",
+                **days,
+                "y": cols["cancellations"],
+                "name": "Cancelaciones",
+                "marker": {"color": "#94a3b8"},
+            },
+            *[
+                {
+                    "type": "scatter",
+                    "mode": "lines",
+                    **days,
+                    "y": _compact(cols[key] * 100, 1),
+                    "name": label,
+                    "yaxis": "y2",
+                    "line": line,
+                }
+                for key, label, line in rates
+            ],
+        ],
+        xaxis={"title": {"text": "Fecha de llegada"}, "type": "date"},
+        yaxis={"title": {"text": "Cancelaciones"}},
+        yaxis2={
+            **BASE_AXIS,
+            "title": {"text": "Tasa de cancelación (%)"},
+            "overlaying": "y",
+            "side": "right",
+            "showgrid": False,
+            "range": [0, 100],
+        },
+        hovermode="x unified",
+    )
+
+
+def layout_recommendations(
+    df: pd.DataFrame, series: timeseries.DailySeries
+) -> html.Div:
     # 1) tasa de cancelación por segmento
     if {"market_segment", "is_canceled"}.issubset(df.columns):
         seg = (
@@ -200,37 +667,36 @@ def layout_recommendations(df: pd.DataFrame) -> html.Div:
             .sort_values("is_canceled", ascending=False)
         )
         seg["cancel_rate_pct"] = seg["is_canceled"] * 100
-        fig_seg = px.bar(
-            seg,
-            x="market_segment",
-            y="cancel_rate_pct",
+        fig_seg = lean_bar(
+            seg["market_segment"],
+            seg["cancel_rate_pct"],
             title="Segmentos con mayor tasa de cancelación",
+            xaxis={"title": {"text": "Segmento de mercado"}, "tickangle": -25},
+            yaxis={"title": {"text": "Tasa de cancelación"}},
         )
-        fig_seg.update_yaxes(title="Tasa de cancelación")
-        fig_seg.update_xaxes(title="Segmento de mercado", tickangle=-25)
     else:
-        fig_seg = px.bar()
+        fig_seg = empty_figure()
 
     # 2) estacionalidad por mes
     if {"arrival_date_month", "is_canceled"}.issubset(df.columns):
         month = (
             df.groupby("arrival_date_month")["is_canceled"]
             .mean()
+            .reindex(etl.MONTHS)
+            .dropna()
+            .rename_axis("arrival_date_month")
             .reset_index()
-            .sort_values("arrival_date_month")
         )
         month["cancel_rate_pct"] = month["is_canceled"] * 100
-        fig_month = px.line(
-            month,
-            x="arrival_date_month",
-            y="cancel_rate_pct",
-            markers=True,
+        fig_month = lean_line(
+            month["arrival_date_month"],
+            month["cancel_rate_pct"],
             title="Estacionalidad de la cancelación por mes de llegada",
+            xaxis={"title": {"text": "Mes de llegada"}, "tickangle": -25},
+            yaxis={"title": {"text": "Tasa de cancelación"}},
         )
-        fig_month.update_yaxes(title="Tasa de cancelación")
-        fig_month.update_xaxes(title="Mes de llegada", tickangle=-25)
     else:
-        fig_month = px.line()
+        fig_month = empty_figure()
 
     # 3) correlación numéricas con cancelación
     if "is_canceled" in df.columns:
@@ -244,31 +710,31 @@ def layout_recommendations(df: pd.DataFrame) -> html.Div:
         corr_df["pretty_name"] = corr_df["variable"].apply(pretty_label)
 
         # Barras con degradado azul marino (de azul claro a azul muy oscuro)
-        fig_corr = px.bar(
-            corr_df,
-            x="pretty_name",
-            y="importance",
-            color="importance",
-            color_continuous_scale=[
-                [0.0, "#bfdbfe"],  # azul muy claro
-                [1.0, "#1e3a8a"],  # azul marino oscuro
-            ],
+        fig_corr = lean_bar(
+            corr_df["pretty_name"],
+            corr_df["importance"],
             title="Factores numéricos más asociados a la cancelación",
-        )
-        fig_corr.update_yaxes(
-            title="Importancia (|correlación| con la cancelación)",
-            title_standoff=20,
-        )
-        fig_corr.update_xaxes(
-            title="",  # quitamos pretty_name del eje X
-            tickangle=-35,
-        )
-        fig_corr.update_layout(
+            trace={
+                "marker": {
+                    "color": _compact(corr_df["importance"]),
+                    "colorscale": [
+                        [0.0, "#bfdbfe"],  # azul muy claro
+                        [1.0, "#1e3a8a"],  # azul marino oscuro
+                    ],
+                    "showscale": False,  # ocultar barra de color
+                },
+            },
+            xaxis={"tickangle": -35},
+            yaxis={
+                "title": {
+                    "text": "Importancia (|correlación| con la cancelación)",
+                    "standoff": 20,
+                },
+            },
             margin=dict(l=80, r=20, t=60, b=80),
-            coloraxis_showscale=False,  # ocultar barra de color
         )
     else:
-        fig_corr = px.bar()
+        fig_corr = empty_figure()
 
     # ---- layout ----
     return html.Div(
@@ -301,6 +767,27 @@ def layout_recommendations(df: pd.DataFrame) -> html.Div:
                 ],
                 className="card",
             ),
+            # Bloque 1b: evolución diaria (el rango se corta en un callback)
+            html.Div(
+                [
+                    html.H2("Evolución diaria de las cancelaciones"),
+                    html.P(
+                        "Cancelaciones por fecha de llegada y tasa diaria, de 7 y de "
+                        "28 días. Elige un rango de fechas o haz zoom en el gráfico.",
+                        className="app-subtitle",
+                    ),
+                    dcc.DatePickerRange(
+                        id="daily-range",
+                        min_date_allowed=series.start if len(series) else None,
+                        max_date_allowed=series.end if len(series) else None,
+                        start_date=series.start if len(series) else None,
+                        end_date=series.end if len(series) else None,
+                        display_format="DD/MM/YYYY",
+                    ),
+                    dcc.Graph(id="daily-series-chart"),
+                ],
+                className="card",
+            ),
             # Bloque 2: factores numéricos
             html.Div(
                 [
@@ -314,6 +801,37 @@ def layout_recommendations(df: pd.DataFrame) -> html.Div:
                 ],
                 className="card",
             ),
+            # Bloque 2b: previsión sobre la cartera (se rellena en un callback
+            # porque depende del modelo activo)
+            html.Div(
+                [
+                    html.H2("Cancelaciones previstas por fecha de llegada"),
+                    html.P(
+                        "Para cada fecha sumamos la probabilidad de cancelación de las "
+                        "reservas en cartera (sin cancelar y con llegada desde hoy) y los "
+                        "ingresos en riesgo (ADR × noches × "
+                        "probabilidad). El nivel de overbooking es el número de "
+                        "cancelaciones que se alcanzan con la confianza elegida. Pulsa "
+                        "en una fecha para ver la distribución de cancelaciones.",
+                        className="app-subtitle",
+                    ),
+                    html.Label("Confianza:"),
+                    dcc.Dropdown(
+                        id="portfolio-confidence",
+                        options=[
+                            {"label": f"{c:.0%}", "value": c} for c in (0.8, 0.9, 0.95)
+                        ],
+                        value=0.9,
+                        clearable=False,
+                        className="dash-dropdown",
+                        style={"width": "160px"},
+                    ),
+                    html.Div(id="portfolio-summary"),
+                    dcc.Graph(id="portfolio-forecast"),
+                    dcc.Graph(id="portfolio-distribution"),
+                ],
+                className="card",
+            ),
             # Bloque 3 y 4: flipcards (los dejamos como los tenías)
             html.Div(
                 [
@@ -568,10 +1086,120 @@ def layout_recommendations(df: pd.DataFrame) -> html.Div:
     )
 
 
+# -------------------------------------------------
+# Explicación de una predicción
+# -------------------------------------------------
+def explanation_panel(explanation: dict) -> html.Div:
+    """
+    Muestra por qué el árbol ha dado esa probabilidad: el efecto de cada
+    variable (en puntos porcentuales) y las reglas que ha seguido.
+    """
+    items = []
+    for col, contrib in explanation["contributions"].items():
+        if abs(contrib) < 0.0005:
+            continue
+        color = "red" if contrib > 0 else "green"
+        items.append(
+            html.Li(
+                [
+                    f"{pretty_label(col)}: ",
+                    html.Span(
+                        f"{contrib*100:+.1f} pp",
+                        style={"color": color, "fontWeight": "bold"},
+                    ),
+                ]
+            )
+        )
+
+    rules = [
+        html.Li(
+            f"{pretty_label(col)} {op} "
+            + (
+                ", ".join(map(str, threshold))
+                if isinstance(threshold, list)
+                else f"{threshold:.2f}"
+            )
+        )
+        for col, op, threshold in explanation["path"]
+    ]
+
+    return html.Div(
+        [
+            html.P(
+                f"Tasa base de cancelación: {explanation['base']*100:.1f}%. "
+                "Efecto de cada variable sobre la probabilidad:"
+            ),
+            html.Ul(items),
+            html.Details(
+                [
+                    html.Summary("Reglas del árbol aplicadas"),
+                    html.Ol(rules),
+                ]
+            ),
+        ]
+    )
+
+
+# -------------------------------------------------
+# Trabajos en segundo plano
+# -------------------------------------------------
+def job_status(job: dict) -> html.Div:
+    """
+    Barra de progreso y mensaje de un trabajo en segundo plano.
+    """
+    labels = {
+        "queued": "En cola",
+        "running": "En curso",
+        "done": "Terminado",
+        "failed": "Error",
+        "cancelled": "Cancelado",
+    }
+    children = [
+        html.Progress(value=str(job["progress"]), max="1"),
+        html.Span(
+            f" {labels.get(job['status'], job['status'])} "
+            f"({job['progress']*100:.0f}%)"
+        ),
+    ]
+    if job["status"] == "failed":
+        children.append(html.P(job["error"], style={"color": "red"}))
+    return html.Div(children)
+
+
 # -------------------------------------------------
 # Layout general
 # -------------------------------------------------
-def create_layout(df: pd.DataFrame) -> html.Div:
+def property_tabs(bundle: registry.PropertyBundle) -> list:
+    """
+    Contenido de las tres pestañas para una propiedad (se construye una
+    vez por propiedad y se reutiliza).
+    """
+
+    def build():
+        return [
+            dcc.Tab(
+                label="Exploración",
+                value="tab-explore",
+                children=layout_exploration(bundle.df, bundle.index),
+            ),
+            dcc.Tab(
+                label="Predicción",
+                value="tab-predict",
+                children=layout_predictor(bundle.df, bundle.index),
+            ),
+            dcc.Tab(
+                label="Recomendaciones",
+                value="tab-reco",
+                children=layout_recommendations(bundle.df, daily_series(bundle)),
+            ),
+        ]
+
+    return bundle.aggregate("tabs", build)
+
+
+def create_layout(properties: registry.DatasetRegistry) -> html.Div:
+    bundle = properties.get()
+
     return html.Div(
         [
             html.Div(
@@ -581,6 +1209,20 @@ def create_layout(df: pd.DataFrame) -> html.Div:
                         "Predice cancelaciones de reservas y explora tus datos hoteleros.",
                         className="header-subtitle",
                     ),
+                    dcc.Dropdown(
+                        id="property-select",
+                        options=[
+                            {"label": name, "value": name}
+                            for name in properties.names()
+                        ],
+                        value=bundle.name,
+                        clearable=False,
+                        className="dash-dropdown",
+                        style={
+                            "maxWidth": "320px",
+                            "display": "block" if len(properties.names()) > 1 else "none",
+                        },
+                    ),
                 ],
                 className="header-banner",
             ),
@@ -588,23 +1230,7 @@ def create_layout(df: pd.DataFrame) -> html.Div:
                 id="tabs",
                 value="tab-explore",
                 className="tab-parent",
-                children=[
-                    dcc.Tab(
-                        label="Exploración",
-                        value="tab-explore",
-                        children=layout_exploration(df),
-                    ),
-                    dcc.Tab(
-                        label="Predicción",
-                        value="tab-predict",
-                        children=layout_predictor(df),
-                    ),
-                    dcc.Tab(
-                        label="Recomendaciones",
-                        value="tab-reco",
-                        children=layout_recommendations(df),
-                    ),
-                ],
+                children=property_tabs(bundle),
             ),
             # Contenedor para el overlay global de alto riesgo
             html.Div(id="risk-toast-container"),
@@ -616,57 +1242,99 @@ def create_layout(df: pd.DataFrame) -> html.Div:
 # -------------------------------------------------
 # Callbacks
 # -------------------------------------------------
-def register_callbacks(app, df: pd.DataFrame, ml_model):
+def register_callbacks(app, properties: registry.DatasetRegistry):
+    # Todos los callbacks reciben la propiedad seleccionada y piden sus
+    # datos y su modelo al registro (que los carga si hace falta).
+    app.registry = properties
+    prop = State("property-select", "value")
+
+    filter_inputs = [Input(f"filter-{col}", "value") for col in cube.FILTER_COLUMNS]
+    category_states = [State(f"input-{col}", "value") for col in CATEGORY_INPUTS]
+
+    def selected_rows(index, filter_values):
+        return index.select(dict(zip(cube.FILTER_COLUMNS, filter_values)))
+
+    # Cambio de propiedad: se regeneran las pestañas con sus datos
+    @app.callback(
+        Output("tabs", "children"),
+        Input("property-select", "value"),
+        prevent_initial_call=True,
+    )
+    def switch_property(name):
+        return property_tabs(properties.get(name))
+
     # Exploración
+    @app.callback(
+        Output("filter-summary", "children"),
+        filter_inputs,
+        prop,
+    )
+    def update_filter_summary(*args):
+        *filter_values, name = args
+        index = properties.get(name).index
+        n = index.count(selected_rows(index, filter_values))
+        return f"{n:,} de {index.n_rows:,} reservas seleccionadas".replace(",", ".")
+
     @app.callback(
         Output("hist-cancellations", "figure"),
-        Input("numeric-col", "value"),
+        [Input("numeric-col", "value"), *filter_inputs],
+        prop,
     )
-    def update_hist(numeric_col):
-        if numeric_col is None or numeric_col not in df.columns:
-            return px.histogram()
-
-        fig = px.histogram(
-            df,
-            x=numeric_col,
-            color="is_canceled",
+    @render_stats.instrument("hist-cancellations")
+    def update_hist(numeric_col, *args):
+        *filter_values, name = args
+        index = properties.get(name).index
+        if numeric_col is None or numeric_col not in index.numeric:
+            return empty_figure()
+
+        rows = selected_rows(index, filter_values)
+        fig = lean_histogram(
+            index.values(numeric_col, rows),
+            index.values("is_canceled", rows).astype(int),
             nbins=40,
-            barmode="overlay",
             title=f"Distribución de {pretty_label(numeric_col)}",
+            xaxis={"title": {"text": numeric_col}},
+            yaxis={"title": {"text": "count"}},
+            legend={"title": {"text": "is_canceled"}},
         )
         return fig
 
     @app.callback(
         Output("bar-cancellations", "figure"),
-        Input("cat-col", "value"),
+        [Input("cat-col", "value"), *filter_inputs],
+        prop,
     )
-    def update_bar(cat_col):
-        if cat_col is None or "is_canceled" not in df.columns:
-            return px.bar()
+    @render_stats.instrument("bar-cancellations")
+    def update_bar(cat_col, *args):
+        *filter_values, name = args
+        bundle = properties.get(name)
+        index = bundle.index
+        if cat_col is None or index.target is None or cat_col not in bundle.df.columns:
+            return empty_figure()
 
-        grouped = (
-            df.groupby(cat_col)["is_canceled"]
-            .mean()
-            .reset_index()
-            .sort_values("is_canceled", ascending=False)
+        cats, rates, _ = index.cancel_rate_by(
+            cat_col, selected_rows(index, filter_values)
+        )
+        grouped = pd.DataFrame({cat_col: cats, "is_canceled": rates}).sort_values(
+            "is_canceled", ascending=False
         )
-        fig = px.bar(
-            grouped,
-            x=cat_col,
-            y="is_canceled",
+        fig = lean_bar(
+            grouped[cat_col],
+            grouped["is_canceled"],
             title=f"Tasa de cancelación por {pretty_label(cat_col)}",
+            xaxis={"title": {"text": cat_col}, "tickangle": -25},
+            yaxis={"title": {"text": "Proporción cancelada"}},
         )
-        fig.update_yaxes(title="Proporción cancelada")
-        fig.update_xaxes(tickangle=-25)
         return fig
 
-    # Predicción + reset en un solo callback (solo 4 variables)
+    # Predicción + reset en un solo callback
     @app.callback(
         [
             Output("input-lead-time", "value"),
             Output("input-total-nights", "value"),
             Output("input-adr", "value"),
             Output("input-special-requests", "value"),
+            *[Output(f"input-{col}", "value") for col in CATEGORY_INPUTS],
             Output("prediction-output", "children"),
             Output("risk-toast-container", "children"),
         ],
@@ -676,6 +1344,8 @@ def register_callbacks(app, df: pd.DataFrame, ml_model):
             State("input-total-nights", "value"),
             State("input-adr", "value"),
             State("input-special-requests", "value"),
+            prop,
+            *category_states,
         ],
         prevent_initial_call=True,
     )
@@ -686,6 +1356,8 @@ def register_callbacks(app, df: pd.DataFrame, ml_model):
         total_nights,
         adr,
         special_requests,
+        name,
+        *category_values,
     ):
         ctx = dash.callback_context
         if not ctx.triggered:
@@ -693,19 +1365,23 @@ def register_callbacks(app, df: pd.DataFrame, ml_model):
 
         triggered = ctx.triggered[0]["prop_id"].split(".")[0]
 
+        bundle = properties.get(name)
+
         # RESET
         if triggered == "btn-reset":
-            mean_lead_time = int(df["lead_time"].mean())
-            mean_total_nights = int(
-                (df["stays_in_weekend_nights"] + df["stays_in_week_nights"]).mean()
+            mean_lead_time, mean_total_nights, mean_adr = bundle.aggregate(
+                "predictor-defaults", lambda: predictor_defaults(bundle.df)
             )
-            mean_adr = float(df["adr"].mean())
 
             return (
                 mean_lead_time,
                 mean_total_nights,
                 round(mean_adr, 2),
                 0,
+                *bundle.aggregate(
+                    "predictor-category-defaults",
+                    lambda: predictor_category_defaults(bundle.index),
+                ),
                 None,
                 None,
             )
@@ -716,10 +1392,12 @@ def register_callbacks(app, df: pd.DataFrame, ml_model):
             "total_nights": total_nights,
             "adr": adr,
             "total_of_special_requests": special_requests,
+            **dict(zip(CATEGORY_INPUTS, category_values)),
         }
 
         try:
-            pred, prob = model_module.predict_cancellation(ml_model, data)
+            pred, prob = model_module.predict_cancellation(bundle.model, data)
+            explanation = model_module.explain_cancellation(bundle.model, data)
         except Exception:
             msg = html.P(
                 "Error al generar la predicción.",
@@ -730,6 +1408,7 @@ def register_callbacks(app, df: pd.DataFrame, ml_model):
                 total_nights,
                 adr,
                 special_requests,
+                *category_values,
                 msg,
                 None,
             )
@@ -772,6 +1451,7 @@ def register_callbacks(app, df: pd.DataFrame, ml_model):
                     style={"color": color, "fontWeight": "bold"},
                 ),
                 html.P(f"Probabilidad: {prob*100:.2f}%"),
+                explanation_panel(explanation),
                 banner,
             ]
         )
@@ -781,6 +1461,453 @@ def register_callbacks(app, df: pd.DataFrame, ml_model):
             total_nights,
             adr,
             special_requests,
+            *category_values,
             msg,
             overlay,
         )
+
+    # Sensibilidad: rejilla antelación × ADR en una sola llamada al modelo
+    grid_size = 200
+
+    def grid_axes(df):
+        lead_max = float(df["lead_time"].quantile(0.99)) if "lead_time" in df.columns else 365.0
+        adr_max = float(df["adr"].quantile(0.99)) if "adr" in df.columns else 300.0
+        return np.linspace(0, lead_max, grid_size), np.linspace(0, adr_max, grid_size)
+
+    @app.callback(
+        Output("sensitivity-heatmap", "figure"),
+        Input("btn-predict", "n_clicks"),
+        [
+            State("input-lead-time", "value"),
+            State("input-total-nights", "value"),
+            State("input-adr", "value"),
+            State("input-special-requests", "value"),
+            prop,
+            *category_states,
+        ],
+    )
+    @render_stats.instrument("sensitivity-heatmap")
+    def update_sensitivity(
+        _, lead_time, total_nights, adr, special_requests, name, *category_values
+    ):
+        bundle = properties.get(name)
+        lead_values, adr_values = bundle.aggregate(
+            "grid-axes", lambda: grid_axes(bundle.df)
+        )
+        data = {
+            "lead_time": lead_time,
+            "total_nights": total_nights,
+            "adr": adr,
+            "total_of_special_requests": special_requests,
+            **dict(zip(CATEGORY_INPUTS, category_values)),
+        }
+        try:
+            grid = model_module.sensitivity_grid(
+                bundle.model, data, lead_values, adr_values
+            )
+        except Exception:
+            return empty_figure()
+
+        fig = lean_heatmap(
+            lead_values,
+            adr_values,
+            grid * 100,
+            xaxis={"title": {"text": pretty_label("lead_time")}},
+            yaxis={"title": {"text": pretty_label("adr")}},
+            showlegend=False,
+            trace={
+                "zmin": 0,
+                "zmax": 100,
+                "colorscale": "RdYlGn_r",
+                "colorbar": {"title": {"text": "% cancelación"}},
+                "hovertemplate": (
+                    "Antelación: %{x:.0f} días<br>ADR: %{y:.2f}"
+                    "<br>Probabilidad: %{z:.1f}%<extra></extra>"
+                ),
+            },
+        )
+        if lead_time is not None and adr is not None:
+            fig["data"].append(
+                {
+                    "type": "scatter",
+                    "x": [lead_time],
+                    "y": [adr],
+                    "mode": "markers",
+                    "marker": {"symbol": "x", "size": 12, "color": "black"},
+                    "name": "Reserva actual",
+                    "hoverinfo": "skip",
+                }
+            )
+        return fig
+
+    # Serie diaria: el zoom y el selector de fechas solo cortan los arrays
+    @app.callback(
+        Output("daily-series-chart", "figure"),
+        [
+            Input("daily-range", "start_date"),
+            Input("daily-range", "end_date"),
+            Input("daily-series-chart", "relayoutData"),
+        ],
+        prop,
+    )
+    @render_stats.instrument("daily-series-chart")
+    def update_daily_series(start_date, end_date, relayout, name):
+        series = daily_series(properties.get(name))
+        triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+        if "daily-series-chart.relayoutData" in triggered and relayout:
+            if "xaxis.range[0]" in relayout:
+                return daily_figure(
+                    series, relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]
+                )
+            if relayout.get("xaxis.autorange"):
+                return daily_figure(series)
+            return dash.no_update
+        return daily_figure(series, start_date, end_date)
+
+    # Previsión de la cartera: puntuada una vez por propiedad y modelo
+    def bundle_portfolio(bundle):
+        pf = bundle.aggregate(
+            "portfolio", lambda: portfolio.Portfolio(bundle.df, bundle.model)
+        )
+        pf.refresh(bundle.model)
+        return pf
+
+    @app.callback(
+        [
+            Output("portfolio-forecast", "figure"),
+            Output("portfolio-summary", "children"),
+        ],
+        Input("portfolio-confidence", "value"),
+        prop,
+    )
+    @render_stats.instrument("portfolio-forecast")
+    def update_portfolio(confidence, name):
+        confidence = confidence or 0.9
+        pf = bundle_portfolio(properties.get(name))
+        summary = pf.summary(confidence)
+        if summary.empty:
+            return empty_figure(), html.P(
+                f"No hay reservas abiertas con llegada desde el {pf.as_of:%d/%m/%Y}."
+            )
+
+        # Eje diario continuo (las fechas sin reservas valen 0): así cada
+        # traza lleva x0 / dx en vez de la lista de fechas
+        daily = summary.reindex(
+            pd.date_range(summary.index.min(), summary.index.max(), freq="D"),
+            fill_value=0,
+        )
+        days = {"x0": f"{daily.index[0]:%Y-%m-%d}", "dx": 86_400_000}
+        band = f"Rango {confidence:.0%}"
+        fig = lean_figure(
+            [
+                {
+                    "type": "scatter",
+                    "mode": "lines",
+                    **days,
+                    "y": _compact(daily["high"]),
+                    "line": {"width": 0},
+                    "name": band,
+                    "legendgroup": "band",
+                    "hoverinfo": "skip",
+                },
+                {
+                    "type": "scatter",
+                    "mode": "lines",
+                    **days,
+                    "y": _compact(daily["low"]),
+                    "line": {"width": 0},
+                    "fill": "tonexty",
+                    "fillcolor": "rgba(99, 110, 250, 0.2)",
+                    "name": band,
+                    "legendgroup": "band",
+                    "showlegend": False,
+                    "hoverinfo": "skip",
+                },
+                {
+                    "type": "scatter",
+                    "mode": "lines",
+                    **days,
+                    "y": _compact(daily["expected"], 2),
+                    "name": "Cancelaciones esperadas",
+                    "line": {"color": "#636efa"},
+                },
+                {
+                    "type": "scatter",
+                    "mode": "lines",
+                    **days,
+                    "y": _compact(daily["overbooking"]),
+                    "name": "Overbooking",
+                    "line": {"color": "#00cc96", "dash": "dot", "shape": "hv"},
+                },
+                {
+                    "type": "scatter",
+                    "mode": "lines",
+                    **days,
+                    "y": _compact(daily["lost_revenue"], 0),
+                    "name": "Ingresos en riesgo",
+                    "yaxis": "y2",
+                    "line": {"color": "#ef553b", "width": 1},
+                },
+            ],
+            xaxis={"title": {"text": "Fecha de llegada"}, "type": "date"},
+            yaxis={"title": {"text": "Cancelaciones"}},
+            yaxis2={
+                **BASE_AXIS,
+                "title": {"text": "Ingresos en riesgo"},
+                "overlaying": "y",
+                "side": "right",
+                "showgrid": False,
+            },
+            hovermode="x unified",
+        )
+
+        total = summary["bookings"].sum()
+        expected = summary["expected"].sum()
+        text = html.P(
+            f"{total:,} reservas en cartera (llegadas desde el {pf.as_of:%d/%m/%Y}): "
+            f"{expected:,.0f} cancelaciones "
+            f"esperadas ({expected / total:.1%}) y {summary['lost_revenue'].sum():,.0f} "
+            "de ingresos en riesgo."
+        )
+        return fig, text
+
+    @app.callback(
+        Output("portfolio-distribution", "figure"),
+        [
+            Input("portfolio-forecast", "clickData"),
+            Input("portfolio-confidence", "value"),
+        ],
+        prop,
+    )
+    @render_stats.instrument("portfolio-distribution")
+    def update_portfolio_distribution(click, confidence, name):
+        confidence = confidence or 0.9
+        pf = bundle_portfolio(properties.get(name))
+        summary = pf.summary(confidence)
+        if summary.empty:
+            return empty_figure()
+
+        date = summary["expected"].idxmax()
+        if click and click.get("points"):
+            clicked = pd.Timestamp(click["points"][0]["x"])
+            if clicked in summary.index:
+                date = clicked
+
+        k, pmf = pf.distribution(date)
+        level = int(summary.loc[date, "overbooking"])
+        fig = lean_bar(
+            k,
+            pmf * 100,
+            title=f"Distribución de cancelaciones el {date:%d/%m/%Y} "
+            f"({summary.loc[date, 'bookings']} reservas)",
+            xaxis={"title": {"text": "Cancelaciones"}},
+            yaxis={"title": {"text": "Probabilidad (%)"}},
+            trace={
+                "marker": {
+                    "color": ["#00cc96" if v >= level else "#636efa" for v in k]
+                },
+                "hovertemplate": "%{x} cancelaciones: %{y:.1f}%<extra></extra>",
+            },
+        )
+        fig["layout"]["annotations"] = [
+            {
+                "x": level,
+                "y": 1,
+                "yref": "paper",
+                "text": f"Overbooking {confidence:.0%}: {level}",
+                "showarrow": False,
+                "yanchor": "bottom",
+            }
+        ]
+        return fig
+
+    # Deriva: se consulta periódicamente, nunca en el camino de la predicción
+    @app.callback(
+        Output("drift-table", "children"),
+        Input("drift-interval", "n_intervals"),
+        prop,
+    )
+    def update_drift(_, name):
+        # cuentas de todos los workers, no solo del que atiende la petición
+        report = properties.drift_scores(name)
+        if report is None:
+            return html.P("El modelo no tiene histogramas de referencia.")
+
+        rows = [
+            html.Tr(
+                [
+                    html.Td(pretty_label(col)),
+                    html.Td("-" if s["psi"] is None else f"{s['psi']:.3f}"),
+                    html.Td("-" if s["ks"] is None else f"{s['ks']:.3f}"),
+                    html.Td(monitoring.drift_status(s["psi"])),
+                ]
+            )
+            for col, s in report["features"].items()
+        ]
+        return html.Div(
+            [
+                html.P(
+                    f"Reservas puntuadas: {report['n_seen']}"
+                    + (
+                        f" (la deriva se calcula a partir de {monitoring.MIN_ROWS})"
+                        if report["n_seen"] < monitoring.MIN_ROWS
+                        else ""
+                    )
+                ),
+                html.Table(
+                    [
+                        html.Thead(
+                            html.Tr(
+                                [
+                                    html.Th("Variable"),
+                                    html.Th("PSI"),
+                                    html.Th("KS"),
+                                    html.Th("Estado"),
+                                ]
+                            )
+                        ),
+                        html.Tbody(rows),
+                    ]
+                ),
+            ]
+        )
+
+    # Puntuación de ficheros: el CSV se guarda en disco y se puntúa por
+    # bloques en el pool de trabajos; el enlace de descarga lo sirve app.py
+    @app.callback(
+        [
+            Output("score-job", "data"),
+            Output("score-poll", "disabled"),
+            Output("score-status", "children"),
+        ],
+        [
+            Input("score-upload", "contents"),
+            Input("btn-score-cancel", "n_clicks"),
+        ],
+        [State("score-upload", "filename"), State("score-job", "data"), prop],
+        prevent_initial_call=True,
+    )
+    def start_or_cancel_scoring(contents, _, filename, job, name):
+        triggered = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
+        if triggered == "btn-score-cancel":
+            if job:
+                jobs.cancel(job)
+            return job, False, dash.no_update
+        if not contents:
+            return dash.no_update, dash.no_update, dash.no_update
+
+        try:
+            path = jobs.save_upload(contents)
+        except ValueError as exc:
+            return None, True, html.P(str(exc), style={"color": "red"})
+
+        params = {
+            "input": str(path),
+            "model": properties.get(name).model,
+            "filename": filename,
+        }
+        return jobs.submit("score", params), False, html.P(f"Subido {filename}.")
+
+    @app.callback(
+        [
+            Output("score-status", "children", allow_duplicate=True),
+            Output("score-poll", "disabled", allow_duplicate=True),
+        ],
+        Input("score-poll", "n_intervals"),
+        State("score-job", "data"),
+        prevent_initial_call=True,
+    )
+    def poll_scoring(_, job_id):
+        job = jobs.get(job_id) if job_id else None
+        if job is None:
+            return None, True
+
+        status = job_status(job)
+        if job["status"] not in jobs.FINISHED:
+            return html.Div([status, html.Small(job["message"] or "")]), False
+
+        if job["status"] == "done":
+            scored = jobs.result(job_id)
+            status = html.Div(
+                [
+                    status,
+                    html.P(
+                        f"{scored['rows']:,} reservas puntuadas"
+                        + (
+                            f" ({scored['imputed']:,} con valores vacíos, "
+                            "puntuadas con los valores por defecto)."
+                            if scored.get("imputed")
+                            else "."
+                        )
+                    ),
+                    html.A(
+                        f"Descargar {scored['filename']}",
+                        href=f"/jobs/{job_id}/download",
+                        download=scored["filename"],
+                    ),
+                ]
+            )
+        return status, True
+
+    # Reentrenamiento en segundo plano: el callback solo encola el trabajo
+    # y el Interval consulta su estado, sin bloquear el worker.
+    @app.callback(
+        [
+            Output("retrain-job", "data"),
+            Output("retrain-poll", "disabled"),
+        ],
+        [
+            Input("btn-retrain", "n_clicks"),
+            Input("btn-retrain-cancel", "n_clicks"),
+        ],
+        [State("retrain-job", "data"), prop],
+        prevent_initial_call=True,
+    )
+    def start_or_cancel_retrain(_, __, job, name):
+        triggered = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
+        if triggered == "btn-retrain-cancel":
+            if job:
+                jobs.cancel(job["id"])
+            return job, False
+
+        params = {
+            "path": str(properties.sources[name]),
+            "mode": model_module.TRAINING_MODE,
+            "property": name,
+        }
+        return {"id": jobs.submit("retrain", params), "property": name}, False
+
+    @app.callback(
+        [
+            Output("retrain-status", "children"),
+            Output("retrain-poll", "disabled", allow_duplicate=True),
+        ],
+        Input("retrain-poll", "n_intervals"),
+        State("retrain-job", "data"),
+        prevent_initial_call=True,
+    )
+    def poll_retrain(_, job_ref):
+        job = jobs.get(job_ref["id"]) if job_ref else None
+        if job is None:
+            return None, True
+
+        status = job_status(job)
+        if job["status"] not in jobs.FINISHED:
+            return status, False
+
+        if job["status"] == "done":
+            # El trabajo ya lo ha publicado: el resto de workers lo cargan
+            # en su siguiente get(); aquí se cambia sin esperar
+            new_model = jobs.result(job["id"])
+            properties.set_model(job_ref["property"], new_model)
+            status = html.Div(
+                [
+                    status,
+                    html.P(
+                        f"Nuevo modelo activo. Accuracy en test: "
+                        f"{new_model.metrics.get('accuracy', float('nan')):.3f}"
+                    ),
+                ]
+            )
+        return status, True
+
@@ -0,0 +1,612 @@
+# src/jobs.py
+"""
+Trabajos en segundo plano para CancelGuard.
+
+Las tareas pesadas (reentrenar el modelo, puntuar ficheros grandes) no
+se ejecutan dentro del callback de Dash: se encolan aquí y corren en un
+pool de procesos. El estado de cada trabajo vive en un SQLite local, así
+que cualquier worker de gunicorn puede consultar su avance o cancelarlo,
+y la interfaz solo tiene que preguntar cada cierto tiempo.
+
+Flujo:
+- submit(kind, params) -> job_id
+- get(job_id) -> {"status", "progress", "message", "error", ...}
+- cancel(job_id)
+- result(job_id) -> lo que devolvió el trabajo (cuando status == "done")
+
+Para añadir un tipo de trabajo se registra una función con
+@job_handler("nombre"). La función recibe (params, ctx) y debe llamar a
+ctx.progress(...) de vez en cuando: si se ha pedido cancelar, esa
+llamada lanza JobCancelled.
+
+Los ficheros subidos desde la interfaz se guardan con save_upload()
+antes de encolar el trabajo que los procesa.
+
+Los trabajos terminados (su fila, su resultado y su carpeta) y las
+subidas huérfanas se borran con cleanup() pasadas RETENTION_HOURS
+(CANCELGUARD_JOB_RETENTION_HOURS, 24 por defecto); submit() la llama
+antes de encolar. Se conservan los que publican un modelo activo.
+
+Cada trabajo guarda el pid del proceso que responde de él (owner_pid):
+el worker web que lo encoló mientras está en cola y el proceso del pool
+mientras corre. Si ese proceso ya no existe (un worker reiniciado, un
+hijo que ha muerto) nadie va a terminarlo: get() y cleanup() lo marcan
+como "failed" para que la interfaz deje de esperar y se pueda borrar.
+
+Un reentrenamiento terminado se publica como modelo activo de su
+propiedad (publish_model); cada worker lo consulta con
+published_model() y carga el resultado del trabajo si su versión no
+es la que tiene en memoria (ver registry.DatasetRegistry.get).
+
+Del mismo modo cada worker guarda las cuentas de su monitor de deriva
+(save_drift) y las puntuaciones se calculan con la suma de todos
+(drift_counts).
+"""
+
+from __future__ import annotations
+
+import base64
+import multiprocessing
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+JOBS_DIR = Path(
+    os.environ.get(
+        "CANCELGUARD_JOBS_DIR",
+        Path(__file__).resolve().parents[1] / ".cancelguard" / "jobs",
+    )
+)
+MAX_WORKERS = int(os.environ.get("CANCELGUARD_JOB_WORKERS", "2"))
+UPLOAD_MAX_BYTES = int(os.environ.get("CANCELGUARD_UPLOAD_MAX_MB", "50")) * 1024 * 1024
+RETENTION_HOURS = float(os.environ.get("CANCELGUARD_JOB_RETENTION_HOURS", "24"))
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro del trabajo cuando alguien ha pedido cancelarlo."""
+
+
+# -------------------------------------------------
+# Almacenamiento (SQLite)
+# -------------------------------------------------
+def _db_path(jobs_dir: Path) -> Path:
+    return jobs_dir / "jobs.sqlite3"
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner_pid INTEGER
+);
+CREATE TABLE IF NOT EXISTS models (
+    property TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS drift (
+    property TEXT NOT NULL,
+    key TEXT NOT NULL,
+    process TEXT NOT NULL,
+    n_seen INTEGER NOT NULL,
+    counts BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (property, key, process)
+)
+"""
+_initialized: set[Path] = set()
+
+
+@contextmanager
+def _connect(jobs_dir: Path):
+    """
+    Conexión corta en modo autocommit; se cierra al salir del bloque.
+    """
+    if jobs_dir not in _initialized:
+        jobs_dir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(_db_path(jobs_dir), timeout=30, isolation_level=None)
+    try:
+        conn.row_factory = sqlite3.Row
+        if jobs_dir not in _initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner_pid" not in columns:
+                # bases de datos creadas antes de guardar el pid
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+            _initialized.add(jobs_dir)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _update(jobs_dir: Path, job_id: str, **fields) -> None:
+    fields["updated_at"] = time.time()
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    with _connect(jobs_dir) as conn:
+        conn.execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ?",
+            [*fields.values(), job_id],
+        )
+
+
+def _result_path(jobs_dir: Path, job_id: str) -> Path:
+    return jobs_dir / f"{job_id}.pkl"
+
+
+def _alive(pid: int | None) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # existe, aunque sea de otro usuario
+    return True
+
+
+def _fail_orphans(conn: sqlite3.Connection, job_id: str | None = None) -> None:
+    """
+    Marca como "failed" los trabajos sin terminar (todos, o solo job_id)
+    cuyo owner_pid ya no existe.
+    """
+    query = "SELECT id, owner_pid FROM jobs WHERE status IN ('queued', 'running')"
+    args: tuple = ()
+    if job_id is not None:
+        query += " AND id = ?"
+        args = (job_id,)
+    orphans = [
+        (row["id"], row["owner_pid"])
+        for row in conn.execute(query, args)
+        if not _alive(row["owner_pid"])
+    ]
+    now = time.time()
+    # owner_pid IS ?: si entretanto otro proceso lo ha cogido, se respeta
+    conn.executemany(
+        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+        "WHERE id = ? AND status IN ('queued', 'running') AND owner_pid IS ?",
+        [
+            ("El proceso que ejecutaba el trabajo ha terminado.", now, i, pid)
+            for i, pid in orphans
+        ],
+    )
+
+
+def save_upload(
+    contents: str,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+    jobs_dir: Path = JOBS_DIR,
+    block_size: int = 1 << 20,
+) -> Path:
+    """
+    Guarda en disco el contenido de un dcc.Upload ("data:...;base64,...")
+    y devuelve la ruta, para pasársela a un trabajo.
+
+    Se decodifica por bloques (múltiplos de 4 caracteres), así que nunca
+    se tiene en memoria una segunda copia entera del fichero. Lanza
+    ValueError si el fichero supera max_bytes.
+    """
+    _, _, payload = contents.partition(",")
+    size = len(payload) // 4 * 3 - payload[-2:].count("=")
+    if size > max_bytes:
+        raise ValueError(
+            f"El fichero ocupa {size / 2**20:.1f} MB y el máximo es "
+            f"{max_bytes / 2**20:.1f} MB."
+        )
+
+    upload_dir = jobs_dir / "uploads"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    path = upload_dir / f"{uuid.uuid4().hex}.csv"
+    step = block_size // 3 * 4
+    with open(path, "wb") as fh:
+        for start in range(0, len(payload), step):
+            fh.write(base64.b64decode(payload[start : start + step]))
+    return path
+
+
+# -------------------------------------------------
+# Registro de tipos de trabajo
+# -------------------------------------------------
+HANDLERS: dict[str, Callable[[dict, "JobContext"], Any]] = {}
+
+
+def job_handler(kind: str):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+class JobContext:
+    """
+    Lo que recibe cada trabajo para informar de su avance.
+
+    workdir es una carpeta propia del trabajo para ficheros de entrada o
+    salida. Con on_done() el trabajo registra acciones que se ejecutan
+    cuando su resultado ya está guardado, justo antes de marcarlo como
+    "done".
+    """
+
+    def __init__(self, jobs_dir: Path, job_id: str):
+        self.jobs_dir = jobs_dir
+        self.job_id = job_id
+        self.workdir = jobs_dir / job_id
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        self._on_done: list[Callable[[], None]] = []
+
+    def on_done(self, action: Callable[[], None]) -> None:
+        self._on_done.append(action)
+
+    def cancel_requested(self) -> bool:
+        with _connect(self.jobs_dir) as conn:
+            row = conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,)
+            ).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def progress(self, fraction: float, message: str | None = None) -> None:
+        if self.cancel_requested():
+            raise JobCancelled(self.job_id)
+        fields = {"progress": max(0.0, min(float(fraction), 1.0))}
+        if message is not None:
+            fields["message"] = message
+        _update(self.jobs_dir, self.job_id, **fields)
+
+
+def _run_job(jobs_dir: Path, job_id: str, kind: str, params: dict) -> None:
+    """
+    Se ejecuta en el proceso del pool. Nunca lanza: el resultado o el
+    error quedan guardados en disco / SQLite.
+    """
+    ctx = JobContext(jobs_dir, job_id)
+    try:
+        if ctx.cancel_requested():
+            raise JobCancelled(job_id)
+        _update(jobs_dir, job_id, status="running", owner_pid=os.getpid())
+        result = HANDLERS[kind](params, ctx)
+        with open(_result_path(jobs_dir, job_id), "wb") as fh:
+            pickle.dump(result, fh)
+        for action in ctx._on_done:
+            action()
+        _update(jobs_dir, job_id, status="done", progress=1.0)
+    except JobCancelled:
+        _update(jobs_dir, job_id, status="cancelled", message="Cancelado")
+    except Exception as exc:
+        _update(
+            jobs_dir,
+            job_id,
+            status="failed",
+            error=f"{exc.__class__.__name__}: {exc}",
+            message=traceback.format_exc(limit=3),
+        )
+
+
+# -------------------------------------------------
+# API pública
+# -------------------------------------------------
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_futures: dict[str, Future] = {}
+
+
+def process_pool(
+    max_workers: int | None = None, preload: list[str] = ()
+) -> ProcessPoolExecutor:
+    """
+    Pool de procesos (uno por núcleo si max_workers es None) para usar
+    desde el proceso web.
+
+    Ese proceso tiene hilos (los de gunicorn / Flask), así que no se hace
+    fork de él: un hijo podría heredar un lock cogido por otro hilo. Se
+    usa forkserver (los hijos salen de un proceso limpio que ya ha
+    importado los módulos de preload) o spawn donde no existe. Los hijos
+    importan el script principal como __mp_main__; app.py no crea la app
+    en ese caso.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+    if preload and context.get_start_method() == "forkserver":
+        # solo tiene efecto antes de arrancar el servidor
+        context.set_forkserver_preload(list(preload))
+    return ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(), mp_context=context
+    )
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    El pool se crea la primera vez que se usa, ya dentro de cada worker
+    de gunicorn.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = process_pool(MAX_WORKERS, [__name__, f"{__package__}.model"])
+        return _executor
+
+
+def _job_finished(jobs_dir: Path, job_id: str, future: Future) -> None:
+    _futures.pop(job_id, None)
+    # _run_job nunca lanza: si hay excepción es que su proceso ha muerto
+    # (BrokenProcessPool) y nadie ha guardado el estado
+    if not future.cancelled() and future.exception() is not None:
+        exc = future.exception()
+        _update(
+            jobs_dir,
+            job_id,
+            status="failed",
+            error=f"{exc.__class__.__name__}: {exc}",
+        )
+
+
+def submit(kind: str, params: dict | None = None, jobs_dir: Path = JOBS_DIR) -> str:
+    """
+    Encola un trabajo y devuelve su identificador.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+    cleanup(jobs_dir=jobs_dir)
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _connect(jobs_dir) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, created_at, updated_at, owner_pid) "
+            "VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, now, now, os.getpid()),
+        )
+
+    future = _get_executor().submit(_run_job, jobs_dir, job_id, kind, params or {})
+    _futures[job_id] = future
+    future.add_done_callback(lambda f: _job_finished(jobs_dir, job_id, f))
+    return job_id
+
+
+def get(job_id: str, jobs_dir: Path = JOBS_DIR) -> dict | None:
+    with _connect(jobs_dir) as conn:
+        _fail_orphans(conn, job_id)
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def cancel(job_id: str, jobs_dir: Path = JOBS_DIR) -> None:
+    """
+    Pide cancelar un trabajo. Si aún no ha empezado se cancela en el acto;
+    si está corriendo, se detiene en su siguiente llamada a ctx.progress().
+    """
+    _update(jobs_dir, job_id, cancel_requested=1)
+    future = _futures.get(job_id)
+    if future is not None and future.cancel():
+        _update(jobs_dir, job_id, status="cancelled", message="Cancelado")
+
+
+def result(job_id: str, jobs_dir: Path = JOBS_DIR) -> Any:
+    job = get(job_id, jobs_dir)
+    if job is None or job["status"] != "done":
+        raise ValueError(f"El trabajo {job_id} no ha terminado correctamente.")
+    with open(_result_path(jobs_dir, job_id), "rb") as fh:
+        return pickle.load(fh)
+
+
+def cleanup(max_age_hours: float = RETENTION_HOURS, jobs_dir: Path = JOBS_DIR) -> int:
+    """
+    Borra los trabajos que terminaron hace más de max_age_hours (fila,
+    resultado y carpeta), salvo los que publican el modelo activo de una
+    propiedad, las subidas igual de antiguas y las cuentas de deriva de
+    modelos que ya no se usan. Antes marca como
+    "failed" los que se han quedado sin proceso, así que también acaban
+    borrándose. Devuelve cuántos trabajos se han borrado.
+    """
+    cutoff = time.time() - max_age_hours * 3600
+    with _connect(jobs_dir) as conn:
+        _fail_orphans(conn)
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ? "
+            "AND id NOT IN (SELECT job_id FROM models)",
+            (*FINISHED, cutoff),
+        ).fetchall()
+        expired = [row["id"] for row in rows]
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in expired])
+
+        # cuentas de deriva de modelos que ya no usa nadie (key distinta de
+        # la última guardada para su propiedad)
+        conn.execute(
+            "DELETE FROM drift WHERE updated_at < ? AND key != ("
+            "SELECT latest.key FROM drift AS latest "
+            "WHERE latest.property = drift.property "
+            "ORDER BY latest.updated_at DESC LIMIT 1)",
+            (cutoff,),
+        )
+
+    for job_id in expired:
+        _result_path(jobs_dir, job_id).unlink(missing_ok=True)
+        shutil.rmtree(jobs_dir / job_id, ignore_errors=True)
+    upload_dir = jobs_dir / "uploads"
+    if upload_dir.is_dir():
+        for path in upload_dir.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass  # la ha borrado su trabajo mientras tanto
+    return len(expired)
+
+
+_process = (0, "")
+
+
+def _process_id() -> str:
+    """
+    Identificador de este proceso para sus filas de deriva. No basta el
+    pid, que se reutiliza, y un uuid de módulo lo compartirían los
+    workers de gunicorn que salen de un fork con la app ya importada.
+    """
+    global _process
+    if _process[0] != os.getpid():
+        _process = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex}")
+    return _process[1]
+
+
+def save_drift(
+    property_name: str, key: str, n_seen: int, counts: bytes, jobs_dir: Path = JOBS_DIR
+) -> None:
+    """
+    Guarda las cuentas del monitor de deriva de este proceso (key es la
+    de monitoring.DriftMonitor).
+    """
+    with _connect(jobs_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO drift "
+            "(property, key, process, n_seen, counts, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (property_name, key, _process_id(), n_seen, counts, time.time()),
+        )
+
+
+def drift_counts(
+    property_name: str, key: str, jobs_dir: Path = JOBS_DIR
+) -> list[tuple[int, bytes]]:
+    """
+    (n_seen, counts) guardados por cada proceso, incluidos los que ya han
+    terminado: sus filas siguen contando.
+    """
+    with _connect(jobs_dir) as conn:
+        rows = conn.execute(
+            "SELECT n_seen, counts FROM drift WHERE property = ? AND key = ?",
+            (property_name, key),
+        ).fetchall()
+    return [(row["n_seen"], row["counts"]) for row in rows]
+
+
+def publish_model(
+    property_name: str, job_id: str, version: str, jobs_dir: Path = JOBS_DIR
+) -> None:
+    """
+    Marca el resultado de job_id (un modelo con esa version) como modelo
+    activo de la propiedad para todos los workers.
+    """
+    with _connect(jobs_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO models (property, job_id, version, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            (property_name, job_id, version, time.time()),
+        )
+
+
+def published_model(property_name: str, jobs_dir: Path = JOBS_DIR) -> dict | None:
+    """
+    {"job_id", "version", ...} del último modelo publicado para la
+    propiedad, o None si nunca se ha reentrenado.
+    """
+    with _connect(jobs_dir) as conn:
+        row = conn.execute(
+            "SELECT * FROM models WHERE property = ?", (property_name,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+# -------------------------------------------------
+# Trabajos disponibles
+# -------------------------------------------------
+@job_handler("retrain")
+def _retrain(params: dict, ctx: JobContext):
+    """
+    params: path, mode y property (si se indica, el modelo se publica
+    como activo de esa propiedad al terminar).
+    """
+    from . import etl, model
+
+    ml_model = model.train(
+        params.get("path", etl.DATA_PATH),
+        mode=params.get("mode", model.TRAINING_MODE),
+        progress=lambda fraction: ctx.progress(fraction, "Entrenando modelo"),
+    )
+    if params.get("property"):
+        ctx.on_done(
+            lambda: publish_model(
+                params["property"], ctx.job_id, ml_model.version, ctx.jobs_dir
+            )
+        )
+    return ml_model
+
+
+@job_handler("score")
+def _score_file(params: dict, ctx: JobContext):
+    """
+    Puntúa un CSV de reservas por bloques y escribe una copia con las
+    columnas cancel_probability, cancel_prediction y cancel_imputed (1
+    si a la reserva le faltaba alguna variable numérica y se ha puntuado
+    con model.FEATURE_DEFAULTS, igual que en la predicción individual).
+
+    params: input (ruta del CSV subido, se borra al terminar), model
+    (CancelGuardModel) y filename (nombre original). Devuelve
+    {"path", "filename", "rows", "imputed"}.
+    """
+    import pandas as pd
+
+    from . import etl, model
+
+    source = Path(params["input"])
+    output = ctx.workdir / "scored.csv"
+    rows = imputed_rows = 0
+    try:
+        header = list(pd.read_csv(source, nrows=0).columns)
+        stays = {"stays_in_weekend_nights", "stays_in_week_nights"}
+        missing = [
+            c
+            for c in model.FEATURES
+            if c not in header and not (c == "total_nights" and stays <= set(header))
+        ]
+        if missing:
+            raise ValueError(f"Faltan columnas en el fichero: {missing}")
+
+        chunksize = params.get("chunksize", 20_000)
+        for chunk, done in etl.iter_chunks(source, chunksize=chunksize):
+            pred, proba = model.predict_batch(params["model"], chunk, monitor=False)
+            imputed = model.missing_features(chunk)
+            chunk = chunk[header]
+            chunk["cancel_probability"] = proba.round(4)
+            chunk["cancel_prediction"] = pred
+            chunk["cancel_imputed"] = imputed.astype(int)
+            chunk.to_csv(output, mode="a", header=rows == 0, index=False)
+            rows += len(chunk)
+            imputed_rows += int(imputed.sum())
+            ctx.progress(done, f"{rows:,} reservas puntuadas")
+        if rows == 0:
+            pd.DataFrame(
+                columns=header
+                + ["cancel_probability", "cancel_prediction", "cancel_imputed"]
+            ).to_csv(output, index=False)
+    finally:
+        source.unlink(missing_ok=True)
+
+    stem = Path(params.get("filename") or "reservas.csv").stem
+    return {
+        "path": str(output),
+        "filename": f"{stem}_scored.csv",
+        "rows": rows,
+        "imputed": imputed_rows,
+    }
@@ -2,43 +2,323 @@
 """
 Módulo de modelo para CancelGuard.
 
-Aquí entrenamos un árbol de decisión sencillo cada vez que se arranca la
-aplicación (cuando se llama a load_model en app.py) y definimos la
+Aquí entrenamos un árbol de decisión sencillo para cada propiedad
+cuando el registro la carga (train, ver src/registry.py) y definimos la
 función de inferencia predict_cancellation.
 
-No se usa ningún .joblib: todo vive dentro de src/model.py.
+Para históricos que no caben en memoria existe load_model_streaming,
+que lee el CSV por bloques y entrena sobre una muestra acotada.
+
+Además de FEATURES (numéricas), el modelo usa como códigos enteros las
+columnas de features.CATEGORICAL_FEATURES que existan en los datos; el
+codificador se guarda dentro del modelo.
+
+load_model_segmented entrena además un árbol por segmento (p. ej. por
+market_segment) en paralelo; las reservas de segmentos pequeños o
+desconocidos usan el árbol global.
+
+No hay ficheros .joblib con modelos ya entrenados. Lo que se guarda en
+disco es la matriz de entrenamiento codificada (caché de
+src/features.py) y los modelos reentrenados en segundo plano, que
+src/jobs.py guarda con pickle para que los carguen todos los workers.
 """
 
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Dict, Any
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator
 
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.tree import DecisionTreeClassifier
 
-from . import etl
+from . import etl, features, jobs, monitoring
+
+FEATURES = ["lead_time", "total_nights", "adr", "total_of_special_requests"]
+TARGET = "is_canceled"
+
+# Valor que se usa al puntuar cuando falta una variable numérica (los
+# mismos que el formulario), tanto en reservas sueltas como en lotes
+FEATURE_DEFAULTS = {
+    "lead_time": 0.0,
+    "total_nights": 1.0,
+    "adr": 0.0,
+    "total_of_special_requests": 0.0,
+}
+
+# "memory" (por defecto), "streaming" para históricos que no caben en RAM
+# o "segmented" para un árbol por segmento
+TRAINING_MODE = os.environ.get("CANCELGUARD_TRAINING", "memory")
+
+# Columnas que definen el segmento en modo "segmented" (separadas por
+# comas, p. ej. "hotel,deposit_type"), mínimo de filas de entrenamiento
+# para que un segmento tenga su propio árbol, procesos para entrenarlos
+# y, si se indica, máximo de filas del árbol global (por defecto todas)
+SEGMENT_COLUMNS = [
+    c.strip()
+    for c in os.environ.get("CANCELGUARD_SEGMENT_BY", "market_segment").split(",")
+    if c.strip()
+]
+MIN_SEGMENT_ROWS = int(os.environ.get("CANCELGUARD_MIN_SEGMENT_ROWS", "1000"))
+SEGMENT_WORKERS = int(os.environ.get("CANCELGUARD_SEGMENT_WORKERS", "0")) or None
+GLOBAL_SAMPLE_ROWS = int(os.environ.get("CANCELGUARD_GLOBAL_SAMPLE_ROWS", "0")) or None
+
+# Columnas con las que se identifica una reserva para el split por hash.
+# Se usan las que existan en el fichero; si no hay ninguna, se usa la
+# posición de la fila.
+BOOKING_KEY_COLUMNS = [
+    "hotel",
+    "name",
+    "email",
+    "arrival_date_year",
+    "arrival_date_week_number",
+    "arrival_date_day_of_month",
+    "lead_time",
+]
+
+
+@dataclass
+class LeafTable:
+    """
+    Tablas precalculadas por nodo del árbol para explicar predicciones.
+
+    - node_proba[n]: probabilidad de cancelación en el nodo n.
+    - contributions[n, f]: cuánto ha movido la variable f la probabilidad
+      desde la raíz hasta el nodo n (suma de saltos padre -> hijo en los
+      splits sobre f). Para una hoja, bias + contributions[n].sum() es
+      exactamente su probabilidad.
+    - paths[n]: condiciones (índice de variable, umbral, va_a_la_izquierda)
+      desde la raíz hasta el nodo n.
+    - thresholds[f]: umbrales (ordenados, sin repetir) que usa el árbol
+      para la variable f.
+    """
+    bias: float
+    node_proba: np.ndarray
+    contributions: np.ndarray
+    paths: list[tuple[tuple[int, float, bool], ...]]
+    thresholds: list[np.ndarray]
+
+
+def build_leaf_table(tree: DecisionTreeClassifier) -> LeafTable:
+    """
+    Recorre el árbol una vez y guarda, para cada nodo, su probabilidad,
+    el camino de splits y la contribución de cada variable.
+
+    Así explicar una predicción es buscar la hoja (O(profundidad)) y
+    leer una fila de la tabla.
+    """
+    t = tree.tree_
+    value = t.value[:, 0, :]
+    node_proba = value[:, 1] / value.sum(axis=1)
+
+    contributions = np.zeros((t.node_count, t.n_features), dtype=float)
+    paths: list[tuple[tuple[int, float, bool], ...]] = [()] * t.node_count
+
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        left, right = t.children_left[node], t.children_right[node]
+        if left == right:  # hoja
+            continue
+        feature, threshold = int(t.feature[node]), float(t.threshold[node])
+        for child, goes_left in ((left, True), (right, False)):
+            contributions[child] = contributions[node]
+            contributions[child, feature] += node_proba[child] - node_proba[node]
+            paths[child] = paths[node] + ((feature, threshold, goes_left),)
+            stack.append(child)
+
+    is_split = t.children_left != t.children_right
+    thresholds = [
+        np.unique(t.threshold[is_split & (t.feature == f)])
+        for f in range(t.n_features)
+    ]
+
+    return LeafTable(
+        bias=float(node_proba[0]),
+        node_proba=node_proba,
+        contributions=contributions,
+        paths=paths,
+        thresholds=thresholds,
+    )
 
 
 @dataclass
 class CancelGuardModel:
     """
     Contenedor del árbol de decisión entrenado.
+
+    metrics guarda las métricas sobre el conjunto de test (accuracy,
+    precision, recall, f1, roc_auc, log_loss) y n_train / n_test.
+    reference guarda los histogramas de X_train que usa el monitor de
+    deriva (ver src/monitoring.py). encoder convierte las variables
+    categóricas en los códigos que ve el árbol: feature_names es FEATURES
+    seguido de encoder.columns.
+
+    Si segment_columns no está vacío, segments guarda un árbol por
+    segmento, con clave la tupla de valores de esas columnas. tree es
+    entonces el árbol global, que se usa para el resto de reservas.
+
+    version identifica cada entrenamiento, para invalidar resultados
+    calculados con un modelo anterior (ver src/portfolio.py).
     """
     tree: DecisionTreeClassifier
     feature_names: list[str]
+    metrics: dict[str, float] = field(default_factory=dict)
+    reference: dict[str, monitoring.FeatureSketch] = field(
+        default_factory=dict, repr=False
+    )
+    encoder: features.CategoryEncoder | None = field(default=None, repr=False)
+    segment_columns: list[str] = field(default_factory=list)
+    segments: dict[tuple, DecisionTreeClassifier] = field(
+        default_factory=dict, repr=False
+    )
+    version: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    leaf_table: LeafTable = field(init=False, repr=False)
+    segment_tables: dict[tuple, LeafTable] = field(init=False, repr=False)
 
+    def __post_init__(self):
+        if self.encoder is None:
+            self.encoder = features.CategoryEncoder([])
+        self.leaf_table = build_leaf_table(self.tree)
+        self.segment_tables = {
+            key: build_leaf_table(tree) for key, tree in self.segments.items()
+        }
+        self._init_caches()
+
+    def _init_caches(self):
+        self._grid_cache: OrderedDict = OrderedDict()
+        self._grid_lock = threading.Lock()
+        self.monitor = (
+            monitoring.DriftMonitor(self.reference, self.feature_names)
+            if self.reference
+            else None
+        )
 
-def load_model() -> CancelGuardModel:
+    # Las cachés, los locks y el monitor son propios de cada proceso:
+    # no se copian al serializar el modelo
+    def __getstate__(self):
+        return {
+            k: v
+            for k, v in self.__dict__.items()
+            if not k.startswith("_") and k != "monitor"
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
+
+
+def _new_tree() -> DecisionTreeClassifier:
+    return DecisionTreeClassifier(
+        max_depth=5,
+        min_samples_leaf=50,
+        random_state=42,
+    )
+
+
+def _leaf_counts(
+    tree: DecisionTreeClassifier, X: np.ndarray, y
+) -> tuple[np.ndarray, np.ndarray]:
     """
-    Entrena (o reentrena) un árbol de decisión a partir de los datos.
+    Cuenta positivos y negativos que caen en cada nodo hoja del árbol.
+
+    Como el árbol solo devuelve una probabilidad por hoja, estas cuentas
+    bastan para calcular todas las métricas, y se pueden acumular bloque
+    a bloque.
+    """
+    n_nodes = tree.tree_.node_count
+    leaves = _leaf_ids(tree, X)
+    y = np.asarray(y).astype(bool)
+    pos = np.bincount(leaves[y], minlength=n_nodes)
+    neg = np.bincount(leaves[~y], minlength=n_nodes)
+    return pos, neg
+
+
+def _metrics_from_leaf_counts(
+    tree: DecisionTreeClassifier, pos: np.ndarray, neg: np.ndarray
+) -> dict[str, float]:
+    """
+    Calcula las métricas de clasificación a partir de las cuentas por hoja.
+    """
+    value = tree.tree_.value[:, 0, :]
+    proba = value[:, 1] / value.sum(axis=1)
+    return _metrics_from_counts(proba, pos, neg)
 
-    Se llama una sola vez al arrancar la app en app.py, y luego el
-    modelo se reutiliza en los callbacks.
+
+def _metrics_from_proba(proba: np.ndarray, y) -> dict[str, float]:
+    """
+    Igual que _metrics_from_leaf_counts, pero a partir de la probabilidad
+    de cada fila (p. ej. cuando las filas vienen de varios árboles).
+    """
+    values, inverse = np.unique(proba, return_inverse=True)
+    y = np.asarray(y).astype(bool)
+    pos = np.bincount(inverse[y], minlength=len(values))
+    neg = np.bincount(inverse[~y], minlength=len(values))
+    return _metrics_from_counts(values, pos, neg)
+
+
+def _metrics_from_counts(
+    proba: np.ndarray, pos: np.ndarray, neg: np.ndarray
+) -> dict[str, float]:
+    """
+    Métricas a partir de grupos de filas con la misma probabilidad:
+    proba[i] es la probabilidad del grupo i y pos[i] / neg[i] cuántos
+    positivos / negativos hay en él.
+    """
+    used = (pos + neg) > 0
+    proba, pos, neg = proba[used], pos[used].astype(float), neg[used].astype(float)
+    n_pos, n_neg = pos.sum(), neg.sum()
+    total = n_pos + n_neg
+
+    predicted = proba > 0.5
+    tp = pos[predicted].sum()
+    fp = neg[predicted].sum()
+    fn = pos[~predicted].sum()
+    tn = neg[~predicted].sum()
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    # AUC con empates: ordenamos hojas por probabilidad y contamos pares
+    order = np.argsort(proba)
+    pos_sorted, neg_sorted = pos[order], neg[order]
+    neg_below = np.cumsum(neg_sorted) - neg_sorted
+    auc_pairs = (pos_sorted * (neg_below + 0.5 * neg_sorted)).sum()
+    roc_auc = auc_pairs / (n_pos * n_neg) if n_pos and n_neg else float("nan")
+
+    eps = 1e-15
+    clipped = np.clip(proba, eps, 1 - eps)
+    log_loss = -(pos * np.log(clipped) + neg * np.log(1 - clipped)).sum() / total
+
+    return {
+        "accuracy": float((tp + tn) / total),
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1": float(f1),
+        "roc_auc": float(roc_auc),
+        "log_loss": float(log_loss),
+        "n_test": int(total),
+    }
+
+
+def _training_frame(
+    path: str | Path, df: pd.DataFrame | None, extra_cols: list[str] = ()
+) -> pd.DataFrame:
+    """
+    Lee (o reutiliza) los datos y deja solo las features, el target y
+    extra_cols, sin filas incompletas.
     """
-    df = etl.load_data()
+    if df is None:
+        df = etl.load_data(path)
+    else:
+        df = df.copy(deep=False)
 
     # Aseguramos que existe total_nights
     if "total_nights" not in df.columns and {
@@ -49,13 +329,7 @@ def load_model() -> CancelGuardModel:
             df["stays_in_weekend_nights"] + df["stays_in_week_nights"]
         )
 
-    required_cols = [
-        "lead_time",
-        "total_nights",
-        "adr",
-        "total_of_special_requests",
-        "is_canceled",
-    ]
+    required_cols = FEATURES + [TARGET] + list(extra_cols)
     missing = [c for c in required_cols if c not in df.columns]
     if missing:
         raise ValueError(
@@ -63,10 +337,22 @@ def load_model() -> CancelGuardModel:
         )
 
     # Dataset para el modelo
-    df_model = df[required_cols].dropna()
+    return df[required_cols].dropna()
+
+
+def load_model(
+    path: str | Path = etl.DATA_PATH, df: pd.DataFrame | None = None
+) -> CancelGuardModel:
+    """
+    Entrena (o reentrena) un árbol de decisión a partir de los datos.
 
-    X = df_model[["lead_time", "total_nights", "adr", "total_of_special_requests"]]
-    y = df_model["is_canceled"]
+    Se llama una vez por propiedad al cargarla (ver src/registry.py), y
+    luego el modelo se reutiliza en los callbacks. Si ya se tiene el
+    DataFrame cargado se puede pasar en df para no volver a leer el CSV
+    (debe ser el contenido de path: la caché de features va por su hash).
+    """
+    X, y, encoder = _encoded_dataset(path, df)
+    feature_names = FEATURES + encoder.columns
 
     X_train, X_test, y_train, y_test = train_test_split(
         X,
@@ -76,46 +362,765 @@ def load_model() -> CancelGuardModel:
         stratify=y,
     )
 
-    tree = DecisionTreeClassifier(
-        max_depth=5,
-        min_samples_leaf=50,
+    tree = _new_tree()
+    tree.fit(X_train, y_train)
+
+    pos, neg = _leaf_counts(tree, X_test, y_test)
+    metrics = _metrics_from_leaf_counts(tree, pos, neg)
+    metrics["n_train"] = int(len(X_train))
+
+    return CancelGuardModel(
+        tree=tree,
+        feature_names=feature_names,
+        metrics=metrics,
+        reference=monitoring.sketch_frame(
+            pd.DataFrame(X_train, columns=feature_names)
+        ),
+        encoder=encoder,
+    )
+
+
+def _encode_frame(
+    df: pd.DataFrame, encoder: features.CategoryEncoder
+) -> np.ndarray:
+    """
+    Matriz de features (numéricas y códigos) en el orden de feature_names.
+
+    Los valores numéricos nulos se sustituyen por FEATURE_DEFAULTS, igual
+    que en _features_from_dict.
+    """
+    numeric = df[FEATURES].to_numpy(dtype=np.float32)
+    return _fill_missing(
+        np.hstack([numeric, encoder.transform(df)]), FEATURES + encoder.columns
+    )
+
+
+def _fill_missing(X: np.ndarray, feature_names: list[str]) -> np.ndarray:
+    """
+    Sustituye los nulos de una matriz de features: FEATURE_DEFAULTS en
+    las numéricas y -1 (categoría desconocida) en los códigos.
+    """
+    missing = np.isnan(X)
+    if not missing.any():
+        return X
+    fill = np.array(
+        [FEATURE_DEFAULTS.get(name, -1) for name in feature_names], dtype=X.dtype
+    )
+    return np.where(missing, fill, X)
+
+
+def missing_features(df: pd.DataFrame) -> np.ndarray:
+    """
+    Máscara de las filas de df a las que les falta alguna variable
+    numérica (y que se puntúan con FEATURE_DEFAULTS).
+    """
+    return df[FEATURES].isna().any(axis=1).to_numpy()
+
+
+def _encoded_dataset(
+    path: str | Path, df: pd.DataFrame | None
+) -> tuple[np.ndarray, np.ndarray, features.CategoryEncoder]:
+    """
+    Devuelve (X, y, encoder) de todo el dataset ya codificado.
+
+    Si el CSV ya se había codificado antes se lee de la caché en disco,
+    sin abrir el CSV ni codificar nada; si no, se codifica y se guarda.
+    """
+    key = features.cache_key(
+        path,
+        {
+            "features": FEATURES,
+            "categorical": features.CATEGORICAL_FEATURES,
+            "target": TARGET,
+        },
+    )
+    cached = features.load_matrix(key)
+    if cached is not None:
+        return cached
+
+    if df is None:
+        df = etl.load_data(path)
+    encoder = features.CategoryEncoder.fit(df)
+    df_model = _training_frame(path, df, encoder.columns)
+    X = _encode_frame(df_model, encoder)
+    y = df_model[TARGET].to_numpy()
+    features.save_matrix(key, X, y, encoder)
+    return X, y, encoder
+
+
+# -------------------------------------------------
+# Un árbol por segmento
+# -------------------------------------------------
+def _fit_tree(X: np.ndarray, y: np.ndarray) -> DecisionTreeClassifier:
+    tree = _new_tree()
+    tree.fit(X, y)
+    return tree
+
+
+def load_model_segmented(
+    path: str | Path = etl.DATA_PATH,
+    df: pd.DataFrame | None = None,
+    segment_columns: list[str] | None = None,
+    min_segment_rows: int = MIN_SEGMENT_ROWS,
+    n_workers: int | None = SEGMENT_WORKERS,
+    global_sample_rows: int | None = GLOBAL_SAMPLE_ROWS,
+) -> CancelGuardModel:
+    """
+    Entrena un árbol global y uno por cada segmento con al menos
+    min_segment_rows filas de entrenamiento (y de las dos clases).
+
+    Todos los árboles se entrenan en paralelo en un pool de n_workers
+    procesos (uno por núcleo si es None), enviando las tareas de mayor a
+    menor. Cada árbol es una tarea que no se puede repartir, así que con
+    N núcleos el tiempo se acerca a max(tarea más grande, trabajo total
+    / N). El global se entrena con todas las filas: puntúa los segmentos
+    pequeños o desconocidos y las filas sin columnas de segmento, así
+    que no se cambia precisión por tiempo. Cuesta tanto como todos los
+    segmentos juntos y limita la mejora a ~2x, pero un árbol de
+    profundidad 5 se entrena en poco más de lo que se tarda en leer los
+    datos. Con global_sample_rows (CANCELGUARD_GLOBAL_SAMPLE_ROWS) se
+    entrena con una muestra de ese tamaño, a cambio de un global peor.
+
+    Las métricas se calculan sobre el mismo test que load_model,
+    enrutando cada fila a su árbol. Las filas se agrupan por los valores
+    originales de las columnas de segmento, así que aquí no se usa la
+    caché de features de load_model.
+    """
+    segment_columns = list(segment_columns or SEGMENT_COLUMNS)
+    if df is None:
+        df = etl.load_data(path)
+    encoder = features.CategoryEncoder.fit(df)
+    df_model = _training_frame(
+        path, df, list(dict.fromkeys(segment_columns + encoder.columns))
+    )
+    feature_names = FEATURES + encoder.columns
+
+    train_df, test_df = train_test_split(
+        df_model,
+        test_size=0.2,
         random_state=42,
+        stratify=df_model[TARGET],
     )
-    tree.fit(X_train, y_train)
+    X_values = _encode_frame(train_df, encoder)
+    y_values = train_df[TARGET].to_numpy()
 
-    # Si quieres ver el rendimiento:
-    # acc = tree.score(X_test, y_test)
-    # print(f"Accuracy del árbol de decisión: {acc:.3f}")
+    # Filas de cada tarea; la clave None es el árbol global
+    tasks = {}
+    for key, rows in train_df.groupby(segment_columns, sort=True).indices.items():
+        if len(rows) >= min_segment_rows and np.unique(y_values[rows]).size == 2:
+            tasks[_as_segment_key(key)] = rows
+    if global_sample_rows and global_sample_rows < len(y_values):
+        rng = np.random.default_rng(42)
+        tasks[None] = np.sort(
+            rng.choice(len(y_values), global_sample_rows, replace=False)
+        )
+    else:
+        tasks[None] = np.arange(len(y_values))
+    n_global = len(tasks[None])
 
-    return CancelGuardModel(tree=tree, feature_names=list(X.columns))
+    with jobs.process_pool(n_workers, [__name__]) as executor:
+        futures = {
+            key: executor.submit(_fit_tree, X_values[rows], y_values[rows])
+            for key, rows in sorted(tasks.items(), key=lambda item: -len(item[1]))
+        }
+        tree = futures.pop(None).result()
+        segments = {key: future.result() for key, future in futures.items()}
 
+    ml_model = CancelGuardModel(
+        tree=tree,
+        feature_names=feature_names,
+        reference=monitoring.sketch_frame(
+            pd.DataFrame(X_values, columns=feature_names)
+        ),
+        encoder=encoder,
+        segment_columns=segment_columns,
+        segments=segments,
+    )
 
-def predict_cancellation(model: CancelGuardModel, data: Dict[str, Any]):
+    # El monitor no debe contar las filas de test
+    _, proba = predict_batch(ml_model, test_df, monitor=False)
+
+    metrics = _metrics_from_proba(proba, test_df[TARGET])
+    metrics["n_train"] = int(len(train_df))
+    metrics["n_train_global"] = int(n_global)
+    metrics["n_segments"] = len(segments)
+    ml_model.metrics = metrics
+    return ml_model
+
+
+# -------------------------------------------------
+# Entrenamiento por bloques (out-of-core)
+# -------------------------------------------------
+def _holdout_mask(
+    chunk: pd.DataFrame,
+    row_offset: int,
+    test_size: float,
+    random_state: int,
+) -> np.ndarray:
     """
-    Recibe un diccionario con las características de la reserva y devuelve:
-    - pred (0/1)
-    - prob (float en [0,1])
+    Decide qué filas van a holdout con un hash de la clave de reserva.
 
-    Usa el árbol de decisión entrenado en load_model().
+    El resultado no depende del tamaño de bloque ni del orden de lectura,
+    así que el split es reproducible. Como el umbral se aplica igual en
+    ambas clases, la proporción de cancelaciones en train y holdout se
+    mantiene (estratificación en esperanza).
     """
+    key_cols = [c for c in BOOKING_KEY_COLUMNS if c in chunk.columns]
+    hash_key = f"{random_state:016d}"[-16:]
+    if key_cols:
+        hashes = pd.util.hash_pandas_object(
+            chunk[key_cols], index=False, hash_key=hash_key
+        ).to_numpy()
+    else:
+        positions = pd.Series(np.arange(row_offset, row_offset + len(chunk)))
+        hashes = pd.util.hash_pandas_object(
+            positions, index=False, hash_key=hash_key
+        ).to_numpy()
+
+    buckets = hashes % np.uint64(10_000)
+    return buckets < np.uint64(round(test_size * 10_000))
+
+
+def _split_chunks(
+    path: str | Path,
+    read_cols: list[str],
+    required_cols: list[str],
+    chunksize: int,
+    test_size: float,
+    random_state: int,
+) -> Iterator[tuple[pd.DataFrame, np.ndarray, float]]:
+    """
+    Lee el CSV por bloques y devuelve (chunk, holdout, avance): el bloque
+    sin filas incompletas y la máscara de filas que van a holdout.
+
+    Con los mismos parámetros el split es siempre el mismo, así que se
+    puede recorrer varias veces (entrenar, evaluar, comparar).
+    """
+    row_offset = 0
+    for chunk, done in etl.iter_chunks(path, read_cols, chunksize):
+        missing = [c for c in required_cols if c not in chunk.columns]
+        if missing:
+            raise ValueError(
+                f"Faltan columnas necesarias para entrenar el modelo: {missing}"
+            )
+        chunk = chunk.dropna(subset=required_cols)
+        holdout = _holdout_mask(chunk, row_offset, test_size, random_state)
+        row_offset += len(chunk)
+        yield chunk, holdout, done
+
+
+def _reservoir_update(
+    reservoir: np.ndarray,
+    n_seen: int,
+    rows: np.ndarray,
+    rng: np.random.Generator,
+) -> int:
+    """
+    Añade filas a la muestra (algoritmo R vectorizado por bloque).
+
+    Devuelve el número total de filas vistas tras el bloque.
+    """
+    capacity = reservoir.shape[0]
+    n_rows = len(rows)
+
+    n_fill = min(max(capacity - n_seen, 0), n_rows)
+    reservoir[n_seen : n_seen + n_fill] = rows[:n_fill]
+
+    rest = rows[n_fill:]
+    if len(rest):
+        seen_before = np.arange(n_seen + n_fill, n_seen + n_rows)
+        slots = rng.integers(0, seen_before + 1)
+        keep = slots < capacity
+        reservoir[slots[keep]] = rest[keep]
+
+    return n_seen + n_rows
+
+
+def load_model_streaming(
+    path: str | Path = etl.DATA_PATH,
+    chunksize: int = 50_000,
+    test_size: float = 0.2,
+    max_train_rows: int = 200_000,
+    random_state: int = 42,
+    progress: Callable[[float], None] | None = None,
+) -> CancelGuardModel:
+    """
+    Entrena el árbol leyendo el CSV por bloques, con memoria acotada.
+
+    - Primera pasada: cada fila va a train o a holdout según un hash de
+      la reserva; las de train entran en una muestra reservoir de como
+      mucho max_train_rows filas.
+    - Se entrena el árbol sobre esa muestra.
+    - Segunda pasada: se evalúa sobre todo el holdout acumulando cuentas
+      por hoja, sin guardar las filas.
+
+    Los códigos de las variables categóricas se asignan según aparecen
+    los valores en la primera pasada (ver features.CategoryEncoder).
+
+    progress, si se pasa, recibe el avance en [0, 1].
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    encoder = features.CategoryEncoder(
+        [c for c in features.CATEGORICAL_FEATURES if c in header]
+    )
+    feature_names = FEATURES + encoder.columns
+    required_cols = FEATURES + [TARGET] + encoder.columns
+    read_cols = required_cols + BOOKING_KEY_COLUMNS
+
+    rng = np.random.default_rng(random_state)
+    reservoir = np.empty((max_train_rows, len(feature_names) + 1), dtype=np.float32)
+    n_seen = 0
+    split = (path, read_cols, required_cols, chunksize, test_size, random_state)
+
+    for chunk, holdout, done in _split_chunks(*split):
+        encoder.update(chunk)
+        train = ~holdout
+
+        rows = np.hstack(
+            [
+                _encode_frame(chunk.loc[train], encoder),
+                chunk.loc[train, [TARGET]].to_numpy(dtype=np.float32),
+            ]
+        )
+        n_seen = _reservoir_update(reservoir, n_seen, rows, rng)
+        if progress is not None:
+            progress(0.5 * done)
+
+    sample = reservoir[: min(n_seen, max_train_rows)]
+    if not len(sample):
+        raise ValueError("No hay filas de entrenamiento en el fichero.")
+
+    tree = _new_tree()
+    X_sample = sample[:, :-1]
+    tree.fit(X_sample, sample[:, -1])
+
+    n_nodes = tree.tree_.node_count
+    pos = np.zeros(n_nodes, dtype=np.int64)
+    neg = np.zeros(n_nodes, dtype=np.int64)
+    for chunk, holdout, done in _split_chunks(*split):
+        if holdout.any():
+            chunk_pos, chunk_neg = _leaf_counts(
+                tree,
+                _encode_frame(chunk.loc[holdout], encoder),
+                chunk.loc[holdout, TARGET],
+            )
+            pos += chunk_pos
+            neg += chunk_neg
+        if progress is not None:
+            progress(0.5 + 0.5 * done)
+
+    metrics = _metrics_from_leaf_counts(tree, pos, neg)
+    metrics["n_train"] = int(len(sample))
+    metrics["n_train_seen"] = int(n_seen)
+
+    return CancelGuardModel(
+        tree=tree,
+        feature_names=feature_names,
+        metrics=metrics,
+        reference=monitoring.sketch_frame(
+            pd.DataFrame(X_sample, columns=feature_names)
+        ),
+        encoder=encoder,
+    )
+
+
+def train(
+    path: str | Path = etl.DATA_PATH,
+    mode: str = TRAINING_MODE,
+    progress: Callable[[float], None] | None = None,
+    df: pd.DataFrame | None = None,
+) -> CancelGuardModel:
+    """
+    Entrena con el modo indicado ("memory", "streaming" o "segmented").
+
+    El entrenamiento en memoria no informa del avance intermedio: solo
+    se llama a progress al empezar y al terminar. df solo se usa en los
+    modos "memory" y "segmented"; en "streaming" siempre se lee el CSV
+    por bloques.
+    """
+    if mode == "streaming":
+        return load_model_streaming(path, progress=progress)
+    if mode not in ("memory", "segmented"):
+        raise ValueError(f"Modo de entrenamiento desconocido: {mode}")
+
+    if progress is not None:
+        progress(0.0)
+    if mode == "segmented":
+        ml_model = load_model_segmented(path, df)
+    else:
+        ml_model = load_model(path, df)
+    if progress is not None:
+        progress(1.0)
+    return ml_model
+
+
+def compare_training_modes(
+    path: str | Path = etl.DATA_PATH,
+    chunksize: int = 50_000,
+    test_size: float = 0.2,
+    random_state: int = 42,
+    **streaming_kwargs,
+) -> dict[str, dict[str, float]]:
+    """
+    Entrena en memoria y por bloques y devuelve, por métrica, los dos
+    valores y la diferencia (streaming - en memoria).
+
+    Los dos árboles se evalúan sobre el mismo holdout (el split por hash
+    de load_model_streaming) y el de memoria se entrena con todas las
+    demás filas, así que la diferencia mide solo el efecto de entrenar
+    sobre la muestra acotada.
+    """
+    streaming = load_model_streaming(
+        path,
+        chunksize=chunksize,
+        test_size=test_size,
+        random_state=random_state,
+        **streaming_kwargs,
+    ).metrics
+
+    header = pd.read_csv(path, nrows=0).columns
+    categorical = [c for c in features.CATEGORICAL_FEATURES if c in header]
+    required_cols = FEATURES + [TARGET] + categorical
+    chunks, holdouts = [], []
+    for chunk, holdout, _ in _split_chunks(
+        path,
+        required_cols + BOOKING_KEY_COLUMNS,
+        required_cols,
+        chunksize,
+        test_size,
+        random_state,
+    ):
+        chunks.append(chunk[required_cols])
+        holdouts.append(holdout)
+    df = pd.concat(chunks, ignore_index=True)
+    holdout = np.concatenate(holdouts)
+
+    encoder = features.CategoryEncoder.fit(df, categorical)
+    X = _encode_frame(df, encoder)
+    y = df[TARGET].to_numpy()
+    tree = _fit_tree(X[~holdout], y[~holdout])
+    in_memory = _metrics_from_leaf_counts(
+        tree, *_leaf_counts(tree, X[holdout], y[holdout])
+    )
+
+    report = {}
+    for name in ["accuracy", "precision", "recall", "f1", "roc_auc", "log_loss"]:
+        report[name] = {
+            "in_memory": in_memory[name],
+            "streaming": streaming[name],
+            "delta": streaming[name] - in_memory[name],
+        }
+    return report
+
+
+def format_comparison(report: dict[str, dict[str, float]]) -> str:
+    """
+    Tabla de texto con el resultado de compare_training_modes.
+    """
+    lines = [f"{'métrica':<10} {'memoria':>9} {'bloques':>9} {'delta':>9}"]
+    for name, row in report.items():
+        lines.append(
+            f"{name:<10} {row['in_memory']:>9.4f} {row['streaming']:>9.4f} "
+            f"{row['delta']:>+9.4f}"
+        )
+    return "\n".join(lines)
+
+
+# -------------------------------------------------
+# Inferencia
+# -------------------------------------------------
+def _check_model(model) -> None:
     if model is None or not isinstance(model, CancelGuardModel):
         raise ValueError(
             "El modelo no está inicializado correctamente. "
-            "Asegúrate de llamar a load_model() en app.py."
+            "Usa el de la propiedad (registry.DatasetRegistry.get) "
+            "o entrena uno con model.train()."
         )
 
-    # Extraemos variables numéricas con valores por defecto
-    lead_time = float(data.get("lead_time") or 0)
-    total_nights = float(data.get("total_nights") or 1)
-    adr = float(data.get("adr") or 0.0)
-    special_requests = float(data.get("total_of_special_requests") or 0)
 
-    features = np.array(
-        [[lead_time, total_nights, adr, special_requests]],
-        dtype=float,
+def _features_from_dict(model: CancelGuardModel, data: Dict[str, Any]) -> np.ndarray:
+    """
+    Convierte el diccionario de entrada en una fila de features. Las
+    variables numéricas que falten (None, "" o NaN) toman el valor de
+    FEATURE_DEFAULTS; las categóricas que falten o no se conozcan se
+    codifican como -1.
+    """
+    numeric = []
+    for name in FEATURES:
+        value = data.get(name)
+        if value is None or value == "" or pd.isna(value):
+            value = FEATURE_DEFAULTS[name]
+        numeric.append(float(value))
+
+    return np.array(
+        [numeric + model.encoder.encode_row(data)],
+        dtype=np.float32,
     )
 
-    proba = model.tree.predict_proba(features)[0, 1]
+
+def _leaf_ids(tree: DecisionTreeClassifier, X) -> np.ndarray:
+    """
+    Hoja del árbol en la que cae cada fila de X (matriz n x features).
+
+    Llama directamente al recorrido del árbol en Cython, sin la
+    validación de sklearn, que es lo que más cuesta en filas sueltas.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    return tree.tree_.apply(X)
+
+
+def _as_segment_key(value) -> tuple:
+    # groupby devuelve un escalar o una tupla según el número de columnas
+    values = value if isinstance(value, tuple) else (value,)
+    return tuple(str(v) for v in values)
+
+
+def _segment_of(model: CancelGuardModel, data: Dict[str, Any]) -> tuple | None:
+    """
+    Segmento de una reserva suelta, o None si el modelo no tiene árboles
+    por segmento o faltan columnas en data.
+    """
+    if not model.segments:
+        return None
+    values = tuple(data.get(c) for c in model.segment_columns)
+    if any(v is None for v in values):
+        return None
+    return _as_segment_key(values)
+
+
+def _tree_for(
+    model: CancelGuardModel, segment: tuple | None
+) -> tuple[DecisionTreeClassifier, LeafTable]:
+    if segment in model.segments:
+        return model.segments[segment], model.segment_tables[segment]
+    return model.tree, model.leaf_table
+
+
+def _check_matrix(model: CancelGuardModel, X) -> np.ndarray:
+    """
+    Matriz ya codificada: tiene que traer una columna por cada variable
+    de model.feature_names (el recorrido en Cython no comprueba el
+    ancho). Los nulos se tratan igual que en un DataFrame.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim != 2 or X.shape[1] != len(model.feature_names):
+        raise ValueError(
+            f"Se esperaba una matriz n x {len(model.feature_names)} "
+            f"({', '.join(model.feature_names)}) y llegó una de forma {X.shape}."
+        )
+    return _fill_missing(X, model.feature_names)
+
+
+def _route_batch(model: CancelGuardModel, X) -> tuple[np.ndarray, list]:
+    """
+    Prepara un lote y reparte sus filas entre los árboles.
+
+    Devuelve la matriz de features y una lista de (árbol, tabla, filas)
+    con un solo grupo por árbol: las filas de segmentos sin árbol propio
+    (o todas, si X no trae las columnas de segmento) van juntas al
+    global. Así cada árbol se evalúa una vez por lote.
+    """
+    everything = [(model.tree, model.leaf_table, slice(None))]
+    if not isinstance(X, pd.DataFrame):
+        return _check_matrix(model, X), everything
+
+    values = _encode_frame(X, model.encoder)
+    if not model.segments or not set(model.segment_columns).issubset(X.columns):
+        return values, everything
+
+    groups = X.groupby(model.segment_columns, sort=False, dropna=False).indices
+    routed, fallback = [], []
+    for value, rows in groups.items():
+        segment = _as_segment_key(value)
+        if segment in model.segments:
+            routed.append((model.segments[segment], model.segment_tables[segment], rows))
+        else:
+            fallback.append(rows)
+    if fallback:
+        routed.append((model.tree, model.leaf_table, np.concatenate(fallback)))
+    return values, routed
+
+
+def predict_batch(
+    model: CancelGuardModel, X, monitor: bool = True
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Predice un lote de reservas de una vez.
+
+    X puede ser un DataFrame con las columnas originales (las categóricas
+    se codifican aquí) o una matriz ya codificada en el orden de
+    model.feature_names (si el ancho no coincide se lanza ValueError).
+    Los nulos se sustituyen como en _features_from_dict. Devuelve
+    (pred, prob) como arrays.
+    Si el modelo tiene árboles por segmento, solo se enrutan las filas
+    de un DataFrame que traiga las columnas de segmento.
+
+    Con monitor=False las filas no cuentan para el monitor de deriva
+    (para puntuaciones internas que no son tráfico real).
+    """
+    _check_model(model)
+    X, groups = _route_batch(model, X)
+
+    proba = np.empty(len(X), dtype=np.float64)
+    for tree, table, rows in groups:
+        proba[rows] = table.node_proba[_leaf_ids(tree, X[rows])]
+    if monitor and model.monitor is not None:
+        model.monitor.update(X)
+    return (proba > 0.5).astype(int), proba
+
+
+def explain_batch(model: CancelGuardModel, X) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Explicaciones de un lote: devuelve (contribuciones, hojas).
+
+    contribuciones es una matriz n x features con el efecto de cada
+    variable sobre la probabilidad (respecto al bias del árbol que ha
+    puntuado la fila). hojas son ids de nodo dentro de ese mismo árbol.
+    """
+    _check_model(model)
+    X, groups = _route_batch(model, X)
+
+    contribs = np.empty((len(X), len(model.feature_names)), dtype=np.float64)
+    leaves = np.empty(len(X), dtype=np.intp)
+    for tree, table, rows in groups:
+        leaves[rows] = _leaf_ids(tree, X[rows])
+        contribs[rows] = table.contributions[leaves[rows]]
+    return contribs, leaves
+
+
+def explain_cancellation(model: CancelGuardModel, data: Dict[str, Any]) -> dict:
+    """
+    Explica una predicción individual.
+
+    Devuelve un diccionario con:
+    - base: tasa de cancelación de partida (raíz del árbol)
+    - contributions: {variable: contribución}, ordenado por |contribución|
+    - path: lista de (variable, operador, umbral) de la raíz a la hoja;
+      en las variables categóricas el operador es "en" y el umbral la
+      lista de categorías de ese lado del corte
+    """
+    _check_model(model)
+    tree, table = _tree_for(model, _segment_of(model, data))
+    leaf = int(_leaf_ids(tree, _features_from_dict(model, data))[0])
+
+    contrib = table.contributions[leaf]
+    order = np.argsort(-np.abs(contrib))
+    return {
+        "base": table.bias,
+        "prob": float(table.node_proba[leaf]),
+        "contributions": {
+            model.feature_names[i]: float(contrib[i]) for i in order
+        },
+        "path": [
+            _path_step(model, f, threshold, goes_left)
+            for f, threshold, goes_left in table.paths[leaf]
+        ],
+    }
+
+
+def _path_step(
+    model: CancelGuardModel, f: int, threshold: float, goes_left: bool
+) -> tuple:
+    name = model.feature_names[f]
+    if name in model.encoder.lookup:
+        return name, "en", model.encoder.labels(name, threshold, goes_left)
+    return name, "<=" if goes_left else ">", threshold
+
+
+def predict_cancellation(model: CancelGuardModel, data: Dict[str, Any]):
+    """
+    Recibe un diccionario con las características de la reserva y devuelve:
+    - pred (0/1)
+    - prob (float en [0,1])
+
+    Usa el árbol de decisión entrenado en load_model(), o el de su
+    segmento si data trae las columnas de segmento.
+    """
+    _check_model(model)
+
+    tree, table = _tree_for(model, _segment_of(model, data))
+    row = _features_from_dict(model, data)
+    proba = table.node_proba[_leaf_ids(tree, row)[0]]
+    if model.monitor is not None:
+        model.monitor.update(row)
     pred = int(proba > 0.5)
 
     return pred, float(proba)
+
+
+# -------------------------------------------------
+# Sensibilidad (what-if) sobre una rejilla de dos variables
+# -------------------------------------------------
+GRID_CACHE_SIZE = 64
+
+
+def _region_key(table: LeafTable, row: np.ndarray, skip: set[int]) -> tuple:
+    """
+    Identifica la región del árbol en la que cae una fila, ignorando las
+    variables de skip.
+
+    Para cada variable cuenta cuántos umbrales del árbol quedan por
+    debajo del valor. Dos filas con la misma clave recorren el árbol
+    igual, así que dan la misma predicción.
+    """
+    thresholds = table.thresholds
+    return tuple(
+        int(np.searchsorted(thresholds[f], row[f], side="left"))
+        for f in range(len(thresholds))
+        if f not in skip
+    )
+
+
+def sensitivity_grid(
+    model: CancelGuardModel,
+    data: Dict[str, Any],
+    x_values: np.ndarray,
+    y_values: np.ndarray,
+    x_feature: str = "lead_time",
+    y_feature: str = "adr",
+) -> np.ndarray:
+    """
+    Probabilidad de cancelación en una rejilla x_feature × y_feature,
+    dejando el resto de variables como en data.
+
+    Se evalúa toda la rejilla en una sola llamada vectorizada y se
+    devuelve una matriz (len(y_values), len(x_values)). Como el árbol es
+    constante a trozos, el resultado se guarda en caché por región: si
+    las variables fijas caen en la misma región, se reutiliza.
+    """
+    _check_model(model)
+    x_idx = model.feature_names.index(x_feature)
+    y_idx = model.feature_names.index(y_feature)
+    x_values = np.asarray(x_values, dtype=np.float32)
+    y_values = np.asarray(y_values, dtype=np.float32)
+
+    segment = _segment_of(model, data)
+    tree, table = _tree_for(model, segment)
+    base = _features_from_dict(model, data)[0]
+    key = (
+        segment if tree is not model.tree else None,
+        x_idx,
+        y_idx,
+        x_values.tobytes(),
+        y_values.tobytes(),
+        _region_key(table, base, {x_idx, y_idx}),
+    )
+
+    with model._grid_lock:
+        cached = model._grid_cache.get(key)
+        if cached is not None:
+            model._grid_cache.move_to_end(key)
+            return cached
+
+    xx, yy = np.meshgrid(x_values, y_values)
+    X = np.repeat(base[None, :], xx.size, axis=0)
+    X[:, x_idx] = xx.ravel()
+    X[:, y_idx] = yy.ravel()
+    grid = table.node_proba[_leaf_ids(tree, X)].reshape(xx.shape)
+    grid.flags.writeable = False  # se comparte entre llamadas
+
+    with model._grid_lock:
+        model._grid_cache[key] = grid
+        if len(model._grid_cache) > GRID_CACHE_SIZE:
+            model._grid_cache.popitem(last=False)
+    return grid
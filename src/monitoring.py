@@ -0,0 +1,252 @@
+# src/monitoring.py
+"""
+Monitor de deriva (drift) de las variables de entrada del modelo.
+
+Al entrenar guardamos, junto al modelo, un histograma por variable con
+cortes en los cuantiles de X_train (FeatureSketch). En producción, cada
+llamada a predict_cancellation / predict_batch suma sus filas a
+histogramas equivalentes (mismos cortes), así que la memoria no crece
+con el número de predicciones.
+
+Con ambos histogramas calculamos:
+- PSI (Population Stability Index): < 0.1 estable, 0.1-0.25 aviso,
+  > 0.25 deriva.
+- KS: máxima distancia entre las dos distribuciones acumuladas
+  (aproximada sobre los cortes del histograma).
+
+Con pocas filas los histogramas en vivo son puro ruido (con una sola
+predicción el PSI sale ~8), así que no se calcula nada hasta haber
+visto al menos MIN_ROWS filas.
+
+Cada proceso (worker de gunicorn) tiene su propio monitor, pero las
+puntuaciones se calculan con las cuentas de todos: cada worker guarda
+las suyas (counts()) en el almacén compartido, ver
+registry.DatasetRegistry.drift_scores, y scores() recibe la suma.
+Solo se suman monitores con la misma key (mismas variables y cortes).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+PSI_WARNING = 0.1
+PSI_ALERT = 0.25
+MIN_ROWS = 200
+
+
+@dataclass
+class FeatureSketch:
+    """
+    Histograma compacto de una variable.
+
+    edges son los cortes interiores (k-1 valores crecientes) y counts las
+    k cuentas: el bin i recoge los valores v con edges[i-1] <= v < edges[i].
+    """
+    edges: np.ndarray
+    counts: np.ndarray
+
+    @classmethod
+    def from_values(cls, values, n_bins: int = 10) -> FeatureSketch:
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+        edges = np.unique(np.quantile(values, quantiles)) if len(values) else np.array([])
+        counts = np.bincount(
+            np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1
+        )
+        return cls(edges=edges, counts=counts.astype(np.int64))
+
+    def empty_like(self) -> FeatureSketch:
+        return FeatureSketch(edges=self.edges, counts=np.zeros_like(self.counts))
+
+    def proportions(self) -> np.ndarray:
+        total = self.counts.sum()
+        return self.counts / total if total else np.zeros(len(self.counts))
+
+
+def sketch_frame(X: pd.DataFrame, n_bins: int = 10) -> dict[str, FeatureSketch]:
+    """
+    Histogramas de referencia para cada columna de X.
+    """
+    return {col: FeatureSketch.from_values(X[col], n_bins) for col in X.columns}
+
+
+def psi(expected: np.ndarray, actual: np.ndarray, eps: float = 1e-4) -> float:
+    expected = np.clip(expected, eps, None)
+    actual = np.clip(actual, eps, None)
+    return float(((actual - expected) * np.log(actual / expected)).sum())
+
+
+def ks(expected: np.ndarray, actual: np.ndarray) -> float:
+    return float(np.abs(np.cumsum(actual) - np.cumsum(expected)).max())
+
+
+class DriftMonitor:
+    """
+    Acumula las variables que llegan a inferencia y las compara con los
+    histogramas de entrenamiento.
+
+    Las filas sueltas se copian a un buffer pequeño y se pasan a los
+    histogramas en lote cuando se llena (o al pedir las puntuaciones),
+    así que update() apenas añade coste a cada predicción. Las
+    puntuaciones se recalculan en scores() solo si han llegado filas
+    nuevas desde la última vez.
+    """
+
+    BUFFER_ROWS = 256
+
+    def __init__(self, reference: dict[str, FeatureSketch], feature_names: list[str]):
+        self.feature_names = [f for f in feature_names if f in reference]
+        self._columns = [feature_names.index(f) for f in self.feature_names]
+        self.reference = reference
+
+        # Cortes de todas las variables en una sola matriz (relleno con +inf)
+        n_bins = max((len(reference[f].counts) for f in self.feature_names), default=1)
+        self._edges = np.full((len(self.feature_names), n_bins - 1), np.inf)
+        for i, f in enumerate(self.feature_names):
+            edges = reference[f].edges
+            self._edges[i, : len(edges)] = edges
+        self._offsets = np.arange(len(self.feature_names)) * n_bins
+        self._n_bins = n_bins
+
+        self.key = hashlib.sha1(
+            "|".join(self.feature_names).encode() + self._edges.tobytes()
+        ).hexdigest()
+
+        self._counts = np.zeros(len(self.feature_names) * n_bins, dtype=np.int64)
+        self._buffer = np.empty((self.BUFFER_ROWS, len(feature_names)), dtype=np.float32)
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self.n_seen = 0
+        self._scores: dict | None = None
+        self._scores_at = -1
+
+    def _add_to_counts(self, X: np.ndarray) -> None:
+        values = X[:, self._columns]
+        bins = (values[:, :, None] >= self._edges[None, :, :]).sum(axis=2)
+        self._counts += np.bincount(
+            (bins + self._offsets).ravel(), minlength=len(self._counts)
+        )
+
+    def _flush(self) -> None:
+        if self._buffered:
+            self._add_to_counts(self._buffer[: self._buffered])
+            self._buffered = 0
+
+    def update(self, X: np.ndarray) -> None:
+        """
+        Añade un lote (matriz n x variables del modelo) a los histogramas.
+        """
+        if not self.feature_names:
+            return
+        n_rows = len(X)
+        with self._lock:
+            if self._buffered + n_rows > self.BUFFER_ROWS:
+                self._flush()
+            if n_rows > self.BUFFER_ROWS:
+                self._add_to_counts(X)
+            else:
+                self._buffer[self._buffered : self._buffered + n_rows] = X
+                self._buffered += n_rows
+            self.n_seen += n_rows
+
+    def counts(self) -> tuple[int, np.ndarray]:
+        """
+        (filas vistas, cuentas de todos los histogramas) de este proceso.
+        """
+        with self._lock:
+            self._flush()
+            return self.n_seen, self._counts.copy()
+
+    def live_sketches(self, counts: np.ndarray | None = None) -> dict[str, FeatureSketch]:
+        if counts is None:
+            counts = self.counts()[1]
+        counts = counts.reshape(len(self.feature_names), self._n_bins)
+        return {
+            f: FeatureSketch(
+                edges=self.reference[f].edges,
+                counts=counts[i, : len(self.reference[f].counts)],
+            )
+            for i, f in enumerate(self.feature_names)
+        }
+
+    def scores(self, totals: tuple[int, np.ndarray] | None = None) -> dict:
+        """
+        Devuelve {"n_seen": n, "features": {variable: {"psi": .., "ks": ..}}}.
+
+        totals son (filas, cuentas) sumadas de todos los procesos; si es
+        None se usan solo las de este. Mientras no se hayan visto
+        MIN_ROWS filas, psi y ks valen None.
+        """
+        n_seen, counts = totals if totals is not None else (self.n_seen, None)
+        if self._scores is not None and self._scores_at == n_seen:
+            return self._scores
+
+        if counts is None:
+            n_seen, counts = self.counts()
+        features = {}
+        for f, live in self.live_sketches(counts).items():
+            if live.counts.sum() < MIN_ROWS:
+                features[f] = {"psi": None, "ks": None}
+                continue
+            expected = self.reference[f].proportions()
+            actual = live.proportions()
+            features[f] = {"psi": psi(expected, actual), "ks": ks(expected, actual)}
+
+        self._scores = {"n_seen": n_seen, "features": features}
+        self._scores_at = n_seen
+        return self._scores
+
+
+def sum_counts(stored: list[tuple[int, bytes]]) -> tuple[int, np.ndarray]:
+    """
+    Suma los (filas, cuentas) que han guardado varios procesos (cuentas
+    como counts()[1].tobytes()), para pasárselos a scores().
+    """
+    n_seen = sum(n for n, _ in stored)
+    counts = sum(np.frombuffer(data, dtype=np.int64) for _, data in stored)
+    return n_seen, counts
+
+
+def drift_status(value: float | None) -> str:
+    if value is None:
+        return "sin datos"
+    if value >= PSI_ALERT:
+        return "deriva"
+    if value >= PSI_WARNING:
+        return "aviso"
+    return "estable"
+
+
+def prometheus_text(reports: dict[str, dict | None]) -> str:
+    """
+    Puntuaciones de deriva (las de scores(), sumando todos los
+    procesos) en formato de texto de Prometheus, con una etiqueta
+    property por cada modelo cargado.
+    """
+    lines = [
+        "# HELP cancelguard_predictions_total Filas puntuadas por todos los workers.",
+        "# TYPE cancelguard_predictions_total counter",
+        "# HELP cancelguard_feature_psi PSI de la variable frente a entrenamiento.",
+        "# TYPE cancelguard_feature_psi gauge",
+        "# HELP cancelguard_feature_ks KS de la variable frente a entrenamiento.",
+        "# TYPE cancelguard_feature_ks gauge",
+    ]
+    for name, report in reports.items():
+        if report is None:
+            continue
+        lines.append(
+            f'cancelguard_predictions_total{{property="{name}"}} {report["n_seen"]}'
+        )
+        for f, s in report["features"].items():
+            if s["psi"] is None:
+                continue
+            labels = f'property="{name}",feature="{f}"'
+            lines.append(f"cancelguard_feature_psi{{{labels}}} {s['psi']:.6f}")
+            lines.append(f"cancelguard_feature_ks{{{labels}}} {s['ks']:.6f}")
+    return "\n".join(lines) + "\n"
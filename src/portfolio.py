@@ -0,0 +1,265 @@
+# src/portfolio.py
+"""
+Previsión de cancelaciones de la cartera de reservas por fecha de llegada.
+
+Para cada fecha se suman, sobre las reservas abiertas de la cartera,
+la probabilidad de cancelación que da el modelo y los ingresos en
+riesgo (adr × total_nights × probabilidad). Una reserva está abierta si
+no está cancelada y su llegada es el día de referencia (as_of) o
+después: las ya canceladas o con la estancia pasada no se puntúan. El
+día de referencia es hoy, o el de CANCELGUARD_PORTFOLIO_AS_OF
+(AAAA-MM-DD), p. ej. para trabajar con un histórico.
+
+El número de cancelaciones de una fecha es una suma de Bernoullis
+independientes con probabilidades distintas (Poisson-binomial). En vez
+de su distribución exacta (O(n²) por fecha) se usa la aproximación
+normal refinada, que corrige la normal con la asimetría:
+
+    P(X <= k) ≈ Φ(x) + γ (1 - x²) φ(x) / 6,   x = (k + 0.5 - μ) / σ
+
+con μ = Σp, σ² = Σp(1-p) y γ = Σp(1-p)(1-2p) / σ³. Sus cuantiles
+(Cornish-Fisher) dan el nivel de overbooking: con confianza c se
+cancelarán al menos quantile(1 - c) reservas.
+
+Por fecha solo hacen falta cinco sumas, que se actualizan al añadir,
+cambiar o quitar reservas (upsert / remove) puntuando solo las
+afectadas. Si cambia el modelo (otra version), refresh() vuelve a
+puntuar toda la cartera de una vez con predict_batch; si cambia el día
+de referencia, solo quita las reservas que ya han llegado.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+from . import etl, model
+
+
+# -------------------------------------------------
+# Aproximación normal refinada
+# -------------------------------------------------
+def _skewness(variance, third) -> np.ndarray:
+    sd = np.sqrt(np.asarray(variance, dtype=float))
+    safe = np.where(sd > 0, sd, 1.0)
+    return np.where(sd > 0, np.asarray(third) / safe**3, 0.0)
+
+
+def cancellation_cdf(k, expected, variance, third) -> np.ndarray:
+    """
+    P(cancelaciones <= k) con la aproximación normal refinada.
+    """
+    k = np.asarray(k, dtype=float)
+    sd = np.sqrt(np.maximum(variance, 1e-12))
+    x = (k + 0.5 - expected) / sd
+    gamma = _skewness(variance, third)
+    density = np.exp(-0.5 * x**2) / np.sqrt(2 * np.pi)
+    cdf = ndtr(x) + gamma * (1 - x**2) * density / 6
+    return np.clip(cdf, 0.0, 1.0)
+
+
+def cancellation_quantile(q: float, expected, variance, third, bookings) -> np.ndarray:
+    """
+    Menor k con P(cancelaciones <= k) >= q (Cornish-Fisher), en [0, bookings].
+    """
+    z = ndtri(q)
+    gamma = _skewness(variance, third)
+    k = expected + np.sqrt(variance) * (z + gamma * (z**2 - 1) / 6) - 0.5
+    return np.clip(np.ceil(k), 0, bookings).astype(int)
+
+
+# -------------------------------------------------
+# Cartera
+# -------------------------------------------------
+AS_OF = os.environ.get("CANCELGUARD_PORTFOLIO_AS_OF")
+
+
+def as_of_date(as_of=None) -> pd.Timestamp:
+    """
+    Día de referencia: as_of, o si es None CANCELGUARD_PORTFOLIO_AS_OF,
+    o hoy.
+    """
+    return pd.Timestamp(as_of or AS_OF or pd.Timestamp.today()).normalize()
+
+
+def open_bookings(bookings: pd.DataFrame, as_of=None) -> pd.DataFrame:
+    """
+    Reservas en cartera: sin cancelar (is_canceled distinto de 1) y con
+    llegada el día as_of o después.
+    """
+    keep = etl.arrival_dates(bookings) >= as_of_date(as_of)
+    if "is_canceled" in bookings.columns:
+        keep &= bookings["is_canceled"] != 1
+    return bookings[keep.to_numpy()]
+
+
+def _stay_value(bookings: pd.DataFrame) -> np.ndarray:
+    if "total_nights" in bookings.columns:
+        nights = bookings["total_nights"]
+    elif {"stays_in_weekend_nights", "stays_in_week_nights"}.issubset(bookings.columns):
+        nights = bookings["stays_in_weekend_nights"] + bookings["stays_in_week_nights"]
+    else:
+        nights = pd.Series(1, index=bookings.index)
+    adr = bookings["adr"] if "adr" in bookings.columns else 0.0
+    return (adr * nights).fillna(0).to_numpy(dtype=float)
+
+
+class Portfolio:
+    """
+    Sumas por fecha de llegada de las probabilidades de cancelación.
+
+    Solo se guardan las reservas abiertas el día as_of (ver
+    open_bookings), así que bookings puede ser el dataset entero. El
+    índice de bookings identifica cada reserva: upsert con un índice ya
+    existente sustituye esa reserva (o la quita, si ya no está abierta).
+    """
+
+    def __init__(
+        self, bookings: pd.DataFrame, ml_model: model.CancelGuardModel, as_of=None
+    ):
+        self._lock = threading.Lock()
+        self._summaries: dict = {}
+        self.as_of = as_of_date(as_of)
+        self._bookings = open_bookings(bookings, self.as_of)
+        self._rescore(ml_model)
+
+    # --- puntuación -------------------------------------------------
+    def _score(self, bookings: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fecha, probabilidad y valor de cada reserva (sin las que no tienen
+        fecha de llegada).
+        """
+        dates = etl.arrival_dates(bookings)
+        bookings = bookings[dates.notna()]
+        if bookings.empty:
+            return pd.DataFrame(columns=["date", "proba", "value"])
+        _, proba = model.predict_batch(self.model, bookings, monitor=False)
+        return pd.DataFrame(
+            {"date": dates[dates.notna()], "proba": proba, "value": _stay_value(bookings)},
+            index=bookings.index,
+        )
+
+    @staticmethod
+    def _sums(rows: pd.DataFrame) -> pd.DataFrame:
+        p = rows["proba"].to_numpy(dtype=float)
+        moments = pd.DataFrame(
+            {
+                "bookings": 1.0,
+                "expected": p,
+                "variance": p * (1 - p),
+                "third": p * (1 - p) * (1 - 2 * p),
+                "lost_revenue": rows["value"].to_numpy(dtype=float) * p,
+            },
+            index=rows.index,
+        )
+        return moments.groupby(rows["date"]).sum()
+
+    def _rescore(self, ml_model: model.CancelGuardModel) -> None:
+        self.model = ml_model
+        self.version = ml_model.version
+        self._rows = self._score(self._bookings)
+        self._totals = self._sums(self._rows)
+        self._summaries.clear()
+
+    def refresh(self, ml_model: model.CancelGuardModel, as_of=None) -> None:
+        """
+        Quita las reservas que llegan antes del nuevo día de referencia y,
+        si el modelo ha cambiado, vuelve a puntuar toda la cartera.
+        """
+        as_of = as_of_date(as_of)
+        with self._lock:
+            if as_of > self.as_of:
+                self.as_of = as_of
+                self._drop(self._rows.index[self._rows["date"] < as_of])
+                self._summaries.clear()
+            if ml_model.version != self.version:
+                self._rescore(ml_model)
+
+    # --- cambios en la cartera --------------------------------------
+    def _drop(self, index: pd.Index) -> None:
+        old = self._rows.index.intersection(index)
+        if len(old):
+            self._totals = self._totals.sub(
+                self._sums(self._rows.loc[old]), fill_value=0
+            )
+            self._rows = self._rows.drop(old)
+        self._bookings = self._bookings.drop(
+            self._bookings.index.intersection(index)
+        )
+
+    def upsert(self, bookings: pd.DataFrame) -> None:
+        """
+        Añade reservas nuevas o sustituye las que ya existen (mismo índice).
+        Solo se puntúan estas filas.
+        """
+        with self._lock:
+            self._drop(bookings.index)
+            bookings = open_bookings(bookings, self.as_of)
+            rows = self._score(bookings)
+            self._bookings = pd.concat([self._bookings, bookings])
+            self._rows = pd.concat([self._rows, rows])
+            self._totals = self._totals.add(self._sums(rows), fill_value=0)
+            self._summaries.clear()
+
+    def remove(self, index) -> None:
+        with self._lock:
+            self._drop(pd.Index(index))
+            self._summaries.clear()
+
+    # --- resultados -------------------------------------------------
+    def summary(self, confidence: float = 0.9) -> pd.DataFrame:
+        """
+        Una fila por fecha de llegada con: bookings, expected (cancelaciones
+        esperadas), lost_revenue, low / high (intervalo central con la
+        confianza indicada) y overbooking (cancelaciones que se alcanzan
+        con esa confianza).
+        """
+        with self._lock:
+            cached = self._summaries.get(confidence)
+            if cached is not None:
+                return cached
+
+            totals = self._totals[self._totals["bookings"] > 0.5].sort_index()
+            args = (
+                totals["expected"].to_numpy(),
+                totals["variance"].to_numpy(),
+                totals["third"].to_numpy(),
+                np.rint(totals["bookings"].to_numpy()),
+            )
+            tail = (1 - confidence) / 2
+            summary = pd.DataFrame(
+                {
+                    "bookings": args[3].astype(int),
+                    "expected": args[0],
+                    "lost_revenue": totals["lost_revenue"].to_numpy(),
+                    "low": cancellation_quantile(tail, *args),
+                    "high": cancellation_quantile(1 - tail, *args),
+                    "overbooking": cancellation_quantile(1 - confidence, *args),
+                },
+                index=totals.index,
+            )
+            self._summaries[confidence] = summary
+            return summary
+
+    def distribution(self, date) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Probabilidad de cada número de cancelaciones k para una fecha,
+        limitado a μ ± 5σ.
+        """
+        with self._lock:
+            row = self._totals.loc[pd.Timestamp(date)]
+        n = int(round(row["bookings"]))
+        sd = np.sqrt(row["variance"])
+        low = max(int(np.floor(row["expected"] - 5 * sd)), 0)
+        high = min(int(np.ceil(row["expected"] + 5 * sd)), n)
+        k = np.arange(low, high + 1)
+        cdf = cancellation_cdf(
+            np.arange(low - 1, high + 1), row["expected"], row["variance"], row["third"]
+        )
+        # la corrección puede no ser monótona en las colas
+        cdf = np.maximum.accumulate(cdf)
+        return k, np.diff(cdf)
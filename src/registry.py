@@ -0,0 +1,346 @@
+# src/registry.py
+"""
+Registro de propiedades (hoteles) para servir varias desde una sola app.
+
+Cada propiedad tiene su propio CSV. Sus datos, su índice de filtros y su
+modelo se cargan la primera vez que se piden (get) y se quedan en
+memoria mientras quepan en el presupuesto: cuando se supera, se
+descargan las propiedades usadas hace más tiempo (LRU).
+
+Fuentes:
+- hotel_booking.csv en la raíz del proyecto (propiedad "default")
+- cada <nombre>.csv dentro de la carpeta properties/ (o la que indique
+  CANCELGUARD_PROPERTIES_DIR) es la propiedad <nombre>
+
+El presupuesto se fija con CANCELGUARD_MEMORY_BUDGET_MB (1024 por
+defecto). La propiedad recién cargada nunca se descarga, aunque ella
+sola supere el presupuesto.
+
+Cuando un reentrenamiento termina, su modelo se publica en el almacén
+de trabajos (jobs.publish_model). Como cada worker de gunicorn tiene su
+propio registro, get() comprueba como mucho cada MODEL_CHECK_SECONDS si
+la versión publicada es otra y, si lo es, carga ese modelo. En esa
+misma comprobación guarda las cuentas de su monitor de deriva, para que
+drift_scores() sume las de todos los workers.
+"""
+
+from __future__ import annotations
+
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from . import cube, etl, jobs, model, monitoring
+
+DEFAULT_PROPERTY = "default"
+PROPERTIES_DIR = Path(
+    os.environ.get("CANCELGUARD_PROPERTIES_DIR", etl.DATA_PATH.parent / "properties")
+)
+MEMORY_BUDGET_MB = int(os.environ.get("CANCELGUARD_MEMORY_BUDGET_MB", "1024"))
+MODEL_CHECK_SECONDS = float(os.environ.get("CANCELGUARD_MODEL_CHECK_SECONDS", "5"))
+
+
+@dataclass
+class PropertyBundle:
+    """
+    Todo lo que la app necesita de una propiedad.
+
+    aggregates guarda resultados derivados (layouts, medias, rejillas...)
+    que se calculan una vez por propiedad con aggregate().
+
+    nbytes estima la memoria de todo ello: el DataFrame (medido al
+    cargar), el índice (incluidos los códigos que se añaden después), el
+    modelo (medido una vez por versión) y cada agregado (medido al
+    construirlo). on_resize, si se indica, se llama cuando crece, para
+    que el registro aplique el presupuesto.
+    """
+    name: str
+    path: Path
+    df: pd.DataFrame
+    index: cube.CategoryIndex
+    model: model.CancelGuardModel
+    aggregates: dict[str, Any] = field(default_factory=dict, repr=False)
+    aggregate_nbytes: dict[str, int] = field(default_factory=dict, repr=False)
+    model_checked_at: float = field(default=0.0, repr=False)
+    on_resize: Callable[[PropertyBundle], None] | None = field(default=None, repr=False)
+
+    def __post_init__(self):
+        self.df_nbytes = int(self.df.memory_usage(deep=True).sum())
+        self._model_nbytes: tuple[str, int] | None = None
+        self._lock = threading.Lock()
+        self._building: dict[str, threading.Lock] = {}
+
+    def aggregate(self, key: str, build: Callable[[], Any]) -> Any:
+        """
+        Devuelve el agregado key, construyéndolo con build() la primera
+        vez. Si varias peticiones lo piden a la vez, solo una lo construye.
+        """
+        value = self.aggregates.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            build_lock = self._building.setdefault(key, threading.Lock())
+        with build_lock:
+            value = self.aggregates.get(key)
+            if value is not None:
+                return value
+            value = build()
+            # lo que ya se cuenta aparte no se vuelve a contar
+            shared = {id(self.df), id(self.index), id(self.model)}
+            self.aggregate_nbytes[key] = deep_nbytes(value, shared)
+            self.aggregates[key] = value
+        if self.on_resize is not None:
+            self.on_resize(self)
+        return value
+
+    @property
+    def nbytes(self) -> int:
+        if self._model_nbytes is None or self._model_nbytes[0] != self.model.version:
+            self._model_nbytes = (self.model.version, deep_nbytes(self.model))
+        return (
+            self.df_nbytes
+            + self.index.nbytes
+            + self._model_nbytes[1]
+            + sum(self.aggregate_nbytes.values())
+        )
+
+
+def deep_nbytes(obj: Any, seen: set[int] | None = None) -> int:
+    """
+    Estimación de la memoria de obj y de todo lo que contiene (arrays,
+    DataFrames, dicts, listas, atributos de objetos...). Los objetos
+    cuyo id está en seen no se cuentan, ni se cuenta dos veces el mismo.
+    """
+    seen = set() if seen is None else seen
+    stack, total = [obj], 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            total += int(np.sum(obj.memory_usage(deep=True)))
+        elif isinstance(obj, np.ndarray):
+            total += obj.nbytes
+            if obj.dtype == object:
+                stack.extend(obj.ravel())
+        elif isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue  # código, no datos
+        elif isinstance(obj, (str, bytes, int, float, bool, type(None))):
+            total += sys.getsizeof(obj)
+        elif isinstance(obj, dict):
+            total += sys.getsizeof(obj)
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            total += sys.getsizeof(obj)
+            stack.extend(obj)
+        else:
+            total += sys.getsizeof(obj)
+            # objetos normales por sus atributos; los de extensiones en C
+            # (p. ej. el árbol de sklearn) por su estado serializable
+            state = getattr(obj, "__dict__", None)
+            if state is None:
+                try:
+                    state = obj.__getstate__()
+                except (AttributeError, TypeError):
+                    state = None
+            if isinstance(state, dict):
+                stack.append(state)
+    return total
+
+
+def _published_model(
+    name: str, current_version: str | None = None
+) -> model.CancelGuardModel | None:
+    """
+    Último modelo publicado para la propiedad, o None si no hay ninguno,
+    si es current_version o si no se puede leer (se sigue con el que hay).
+    """
+    try:
+        published = jobs.published_model(name)
+        if published is None or published["version"] == current_version:
+            return None
+        return jobs.result(published["job_id"])
+    except (OSError, EOFError, sqlite3.Error, ValueError, pickle.UnpicklingError,
+            AttributeError, ImportError):
+        return None
+
+
+def _save_drift(bundle: PropertyBundle) -> bool:
+    monitor = bundle.model.monitor
+    if monitor is None:
+        return False
+    n_seen, counts = monitor.counts()
+    try:
+        jobs.save_drift(bundle.name, monitor.key, n_seen, counts.tobytes())
+    except (OSError, sqlite3.Error):
+        return False
+    return True
+
+
+class DatasetRegistry:
+    def __init__(
+        self,
+        sources: dict[str, Path],
+        memory_budget_mb: int = MEMORY_BUDGET_MB,
+    ):
+        if not sources:
+            raise ValueError("No hay ninguna propiedad configurada.")
+        self.sources = dict(sources)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._bundles: OrderedDict[str, PropertyBundle] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: dict[str, threading.Lock] = {}
+
+    @classmethod
+    def from_environment(cls) -> DatasetRegistry:
+        sources = {}
+        if etl.DATA_PATH.exists():
+            sources[DEFAULT_PROPERTY] = etl.DATA_PATH
+        if PROPERTIES_DIR.is_dir():
+            for csv in sorted(PROPERTIES_DIR.glob("*.csv")):
+                sources[csv.stem] = csv
+        if not sources:
+            raise FileNotFoundError(
+                f"No se encuentra {etl.DATA_PATH} ni ningún CSV en {PROPERTIES_DIR}."
+            )
+        return cls(sources)
+
+    def names(self) -> list[str]:
+        return list(self.sources)
+
+    def default(self) -> str:
+        return next(iter(self.sources))
+
+    def _get(self, name: str | None) -> PropertyBundle:
+        name = name or self.default()
+        if name not in self.sources:
+            raise KeyError(f"Propiedad desconocida: {name}")
+
+        with self._lock:
+            bundle = self._bundles.get(name)
+            if bundle is not None:
+                self._bundles.move_to_end(name)
+                return bundle
+            load_lock = self._loading.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                bundle = self._bundles.get(name)
+            if bundle is None:
+                bundle = self._load(name)
+                with self._lock:
+                    self._bundles[name] = bundle
+                    self._evict(keep=name)
+        return bundle
+
+    def get(self, name: str | None = None) -> PropertyBundle:
+        """
+        Devuelve la propiedad, cargándola si hace falta, con el último
+        modelo publicado.
+
+        Si dos peticiones piden a la vez una propiedad sin cargar, solo
+        una la carga y la otra espera.
+        """
+        bundle = self._get(name)
+        self.sync_model(bundle)
+        return bundle
+
+    def _load(self, name: str) -> PropertyBundle:
+        path = self.sources[name]
+        df = etl.load_data(path)
+        index = cube.CategoryIndex(df)
+        ml_model = _published_model(name)
+        if ml_model is None:
+            ml_model = model.train(path, df=df)
+        return PropertyBundle(
+            name=name,
+            path=path,
+            df=df,
+            index=index,
+            model=ml_model,
+            on_resize=self._resized,
+        )
+
+    def _evict(self, keep: str) -> None:
+        total = sum(b.nbytes for b in self._bundles.values())
+        for name in list(self._bundles):
+            if total <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            total -= self._bundles.pop(name).nbytes
+
+    def _resized(self, bundle: PropertyBundle) -> None:
+        with self._lock:
+            if self._bundles.get(bundle.name) is bundle:
+                self._evict(keep=bundle.name)
+
+    def sync_model(self, bundle: PropertyBundle, force: bool = False) -> None:
+        """
+        Guarda las cuentas de deriva del modelo actual y, si hay un modelo
+        publicado con otra versión, lo pone en la propiedad. Sin force, se
+        hace como mucho cada MODEL_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        if not force and now - bundle.model_checked_at < MODEL_CHECK_SECONDS:
+            return
+        bundle.model_checked_at = now
+        _save_drift(bundle)
+        published = _published_model(bundle.name, bundle.model.version)
+        if published is not None:
+            bundle.model = published
+            self._resized(bundle)
+
+    def set_model(self, name: str, new_model: model.CancelGuardModel) -> None:
+        """
+        Sustituye el modelo de una propiedad (p. ej. tras reentrenar).
+
+        Si la propiedad ya no está en memoria no se hace nada: se volverá
+        a entrenar al cargarla.
+        """
+        with self._lock:
+            bundle = self._bundles.get(name)
+            if bundle is not None:
+                bundle.model = new_model
+                self._evict(keep=name)
+
+    def drift_scores(self, name: str | None = None) -> dict | None:
+        """
+        monitor.scores() de la propiedad con las cuentas de todos los
+        workers (las de este se guardan antes de sumar). None si el
+        modelo no tiene monitor. Si el almacén no responde, solo cuenta
+        este proceso.
+        """
+        bundle = self.get(name)
+        monitor = bundle.model.monitor
+        if monitor is None:
+            return None
+        if not _save_drift(bundle):
+            return monitor.scores()
+        try:
+            stored = jobs.drift_counts(bundle.name, monitor.key)
+        except (OSError, sqlite3.Error):
+            return monitor.scores()
+        return monitor.scores(monitoring.sum_counts(stored))
+
+    def loaded(self) -> list[PropertyBundle]:
+        with self._lock:
+            return list(self._bundles.values())
+
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(b.nbytes for b in self._bundles.values())
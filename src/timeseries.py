@@ -0,0 +1,106 @@
+# src/timeseries.py
+"""
+Serie diaria de reservas y cancelaciones por fecha de llegada.
+
+Se construye una vez por propiedad (ver PropertyBundle.aggregate) a
+partir de la fecha de llegada (etl.arrival_dates) y queda como arrays
+compactos, uno por métrica, con una posición por día del calendario
+desde la primera llegada hasta la última (los días sin reservas valen
+0). Las ventanas móviles de 7 y 28 días se calculan de una vez con
+sumas acumuladas: suma(i - w, i] = acumulado[i] - acumulado[i - w].
+
+Para un rango de fechas basta con calcular las posiciones a partir de
+start y cortar los arrays; nunca se vuelve al DataFrame.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from . import etl
+
+WINDOWS = (7, 28)
+
+
+def _rate(cancellations: np.ndarray, bookings: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(bookings > 0, cancellations / bookings, np.nan).astype(np.float32)
+
+
+@dataclass
+class DailySeries:
+    """
+    start es el primer día; columns[nombre][i] es el valor del día
+    start + i. Columnas: bookings, cancellations, rate y, por cada
+    ventana w de WINDOWS, cancellations_{w}d y rate_{w}d (ventana que
+    acaba ese día).
+    """
+    start: pd.Timestamp
+    columns: dict[str, np.ndarray]
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, target: str = "is_canceled") -> DailySeries:
+        dates = etl.arrival_dates(df)
+        valid = dates.notna().to_numpy()
+        if not valid.any():
+            return cls(start=pd.NaT, columns={})
+
+        days = dates[valid].to_numpy().astype("datetime64[D]")
+        start = days.min()
+        position = (days - start).astype(np.int64)
+        n_days = int(position.max()) + 1
+
+        canceled = (
+            df.loc[valid, target].fillna(0).to_numpy(dtype=np.int64)
+            if target in df.columns
+            else np.zeros(len(position), dtype=np.int64)
+        )
+        bookings = np.bincount(position, minlength=n_days)
+        cancellations = np.bincount(position, weights=canceled, minlength=n_days)
+        cancellations = cancellations.astype(np.int64)
+
+        columns = {
+            "bookings": bookings.astype(np.int32),
+            "cancellations": cancellations.astype(np.int32),
+            "rate": _rate(cancellations, bookings),
+        }
+        cum_bookings = np.concatenate([[0], np.cumsum(bookings)])
+        cum_cancellations = np.concatenate([[0], np.cumsum(cancellations)])
+        end = np.arange(1, n_days + 1)
+        for w in WINDOWS:
+            begin = np.maximum(end - w, 0)
+            window_bookings = cum_bookings[end] - cum_bookings[begin]
+            window_cancellations = cum_cancellations[end] - cum_cancellations[begin]
+            columns[f"cancellations_{w}d"] = window_cancellations.astype(np.int32)
+            columns[f"rate_{w}d"] = _rate(window_cancellations, window_bookings)
+
+        return cls(start=pd.Timestamp(start), columns=columns)
+
+    def __len__(self) -> int:
+        return len(self.columns.get("bookings", ()))
+
+    @property
+    def end(self) -> pd.Timestamp:
+        return self.start + pd.Timedelta(days=len(self) - 1)
+
+    def positions(self, first=None, last=None) -> slice:
+        """
+        Posiciones de los días entre first y last (incluidos); None es
+        el principio / final de la serie.
+        """
+        if not len(self):
+            return slice(0, 0)
+        lo = 0 if first is None else (pd.Timestamp(first).normalize() - self.start).days
+        hi = len(self) - 1 if last is None else (pd.Timestamp(last).normalize() - self.start).days
+        return slice(max(lo, 0), max(min(hi, len(self) - 1) + 1, 0))
+
+    def window(self, first=None, last=None) -> tuple[pd.Timestamp, dict[str, np.ndarray]]:
+        """
+        Primer día y vistas (sin copia) de todas las columnas en el rango.
+        """
+        rows = self.positions(first, last)
+        first_day = self.start + pd.Timedelta(days=rows.start) if len(self) else pd.NaT
+        return first_day, {name: values[rows] for name, values in self.columns.items()}
@@ -0,0 +1,37 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src import features
+
+
+def _save(path, cache_dir, rows):
+    df = pd.DataFrame({"deposit_type": ["No Deposit"] * rows})
+    df.to_csv(path, index=False)
+    key = features.cache_key(path, {"columns": ["deposit_type"]})
+    encoder = features.CategoryEncoder.fit(df)
+    features.save_matrix(key, encoder.transform(df), np.zeros(rows), encoder, cache_dir)
+    return key
+
+
+def test_cache_keeps_only_the_latest_version_of_each_file(tmp_path):
+    cache_dir = tmp_path / "cache"
+    _save(tmp_path / "a.csv", cache_dir, 3)
+    key_b = _save(tmp_path / "b.csv", cache_dir, 3)
+    key_a = _save(tmp_path / "a.csv", cache_dir, 5)
+
+    assert sorted(p.stem for p in cache_dir.glob("*.npz")) == sorted([key_a, key_b])
+    X, _, _ = features.load_matrix(key_a, cache_dir)
+    assert len(X) == 5
+
+
+def test_cache_expires_entries_not_read_for_a_while(tmp_path):
+    cache_dir = tmp_path / "cache"
+    old = _save(tmp_path / "a.csv", cache_dir, 3)
+    stale = time.time() - (features.CACHE_RETENTION_DAYS + 1) * 86400
+    os.utime(cache_dir / f"{old}.npz", (stale, stale))
+
+    _save(tmp_path / "b.csv", cache_dir, 3)
+    assert not (cache_dir / f"{old}.npz").exists()
@@ -0,0 +1,36 @@
+import subprocess
+import sys
+import time
+
+from src import jobs
+
+
+def _dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def _insert(jobs_dir, job_id, status, owner_pid, updated_at=None):
+    now = updated_at or time.time()
+    with jobs._connect(jobs_dir) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, created_at, updated_at, owner_pid) "
+            "VALUES (?, 'retrain', ?, ?, ?, ?)",
+            (job_id, status, now, now, owner_pid),
+        )
+
+
+def test_get_fails_jobs_whose_process_is_gone(tmp_path):
+    _insert(tmp_path, "orphan", "running", _dead_pid())
+    _insert(tmp_path, "alive", "queued", jobs.os.getpid())
+    assert jobs.get("orphan", tmp_path)["status"] == "failed"
+    assert jobs.get("alive", tmp_path)["status"] == "queued"
+
+
+def test_cleanup_removes_orphans_after_retention(tmp_path):
+    _insert(tmp_path, "orphan", "queued", _dead_pid(), updated_at=time.time() - 3600)
+    assert jobs.cleanup(max_age_hours=2, jobs_dir=tmp_path) == 0
+    assert jobs.get("orphan", tmp_path)["status"] == "failed"
+    assert jobs.cleanup(max_age_hours=0, jobs_dir=tmp_path) == 1
+    assert jobs.get("orphan", tmp_path) is None
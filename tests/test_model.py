@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import model
+
+
+def _bookings(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    lead = rng.integers(0, 400, n)
+    requests = rng.integers(0, 4, n)
+    deposit = rng.choice(["No Deposit", "Non Refund", "Refundable"], n, p=[0.8, 0.15, 0.05])
+    p = 1 / (1 + np.exp(-(lead / 150 - requests * 0.6 + (deposit == "Non Refund") * 2 - 0.8)))
+    return pd.DataFrame(
+        {
+            "is_canceled": (rng.random(n) < p).astype(int),
+            "lead_time": lead.astype(float),
+            "total_nights": rng.integers(0, 8, n).astype(float),
+            "adr": rng.gamma(4, 25, n).round(2),
+            "total_of_special_requests": requests.astype(float),
+            "deposit_type": deposit,
+            "market_segment": rng.choice(["Online TA", "Groups", "Direct"], n),
+            "customer_type": rng.choice(["Transient", "Contract", "Group"], n),
+            "arrival_date_month": rng.choice(["January", "July", "December"], n),
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def trained(tmp_path_factory):
+    # una ruta que no existe: sin caché de features
+    path = tmp_path_factory.mktemp("data") / "bookings.csv"
+    return model.load_model(path, df=_bookings(5_000))
+
+
+def _single(ml_model, df):
+    return np.array(
+        [
+            model.predict_cancellation(ml_model, row)[1]
+            for row in df.to_dict(orient="records")
+        ]
+    )
+
+
+def test_batch_matches_single_rows(trained):
+    df = _bookings(500, seed=1)
+    _, proba = model.predict_batch(trained, df, monitor=False)
+    np.testing.assert_array_equal(proba, _single(trained, df))
+
+
+@pytest.mark.parametrize("column", model.FEATURES)
+def test_batch_matches_single_rows_with_missing_values(trained, column):
+    df = _bookings(500, seed=2)
+    df.loc[df.index[::3], column] = np.nan
+    _, proba = model.predict_batch(trained, df, monitor=False)
+    np.testing.assert_array_equal(proba, _single(trained, df))
+    assert model.missing_features(df).sum() == len(df.index[::3])
+
+
+def test_batch_matrix_with_missing_values_uses_defaults(trained):
+    df = _bookings(500, seed=3)
+    df.loc[df.index[::4], "adr"] = np.nan
+    raw = np.hstack(
+        [df[model.FEATURES].to_numpy(dtype=np.float32), trained.encoder.transform(df)]
+    )
+    raw[::5, -1] = np.nan
+    filled = model._encode_frame(df, trained.encoder)
+    filled[::5, -1] = -1
+    _, proba = model.predict_batch(trained, raw, monitor=False)
+    _, expected = model.predict_batch(trained, filled, monitor=False)
+    np.testing.assert_array_equal(proba, expected)
+
+
+@pytest.mark.parametrize("shape", [(10, 2), (10, 4), (10,)])
+def test_batch_matrix_with_wrong_width_is_rejected(trained, shape):
+    with pytest.raises(ValueError):
+        model.predict_batch(trained, np.zeros(shape, dtype=np.float32))
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from src import jobs, monitoring
+
+
+def _monitor(reference):
+    return monitoring.DriftMonitor(reference, list(reference))
+
+
+def test_scores_from_merged_counts_match_one_process(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    train = pd.DataFrame({"a": rng.normal(size=2_000), "b": rng.gamma(2, size=2_000)})
+    reference = monitoring.sketch_frame(train)
+    live = rng.normal(0.3, 1.2, size=(900, 2)).astype(np.float32)
+
+    workers = [_monitor(reference), _monitor(reference)]
+    workers[0].update(live[:150])
+    workers[1].update(live[150:])
+    for i, monitor in enumerate(workers):
+        monkeypatch.setattr(jobs, "_process", (jobs.os.getpid(), f"worker-{i}"))
+        n_seen, counts = monitor.counts()
+        jobs.save_drift("p", monitor.key, n_seen, counts.tobytes(), tmp_path)
+
+    stored = jobs.drift_counts("p", workers[0].key, tmp_path)
+    totals = monitoring.sum_counts(stored)
+    single = _monitor(reference)
+    single.update(live)
+
+    assert workers[0].scores()["features"]["a"]["psi"] is None
+    assert workers[0].scores(totals) == single.scores()
+    assert workers[1].key == single.key
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import etl, model, portfolio
+
+
+def _bookings(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    lead = rng.integers(0, 300, n)
+    return pd.DataFrame(
+        {
+            "is_canceled": (rng.random(n) < 0.2 + lead / 600).astype(int),
+            "lead_time": lead.astype(float),
+            "total_nights": rng.integers(1, 8, n).astype(float),
+            "adr": rng.gamma(4, 25, n).round(2),
+            "total_of_special_requests": rng.integers(0, 4, n).astype(float),
+            "deposit_type": rng.choice(["No Deposit", "Non Refund"], n),
+            "arrival_date_year": 2017,
+            "arrival_date_month": rng.choice(etl.MONTHS[5:8], n),
+            "arrival_date_day_of_month": rng.integers(1, 29, n),
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def trained(tmp_path_factory):
+    path = tmp_path_factory.mktemp("data") / "bookings.csv"
+    return model.load_model(path, df=_bookings(3_000))
+
+
+def _exact_cdf(p: np.ndarray) -> np.ndarray:
+    # distribución exacta de la suma de Bernoullis por convolución
+    pmf = np.array([1.0])
+    for q in p:
+        pmf = np.convolve(pmf, [1 - q, q])
+    return np.cumsum(pmf)
+
+
+@pytest.mark.parametrize("n, seed", [(40, 0), (300, 1), (300, 2)])
+def test_refined_normal_matches_exact_poisson_binomial(n, seed):
+    p = np.random.default_rng(seed).beta(1, 3, n)
+    moments = (p.sum(), (p * (1 - p)).sum(), (p * (1 - p) * (1 - 2 * p)).sum())
+    exact = _exact_cdf(p)
+
+    k = np.arange(n + 1)
+    approx = portfolio.cancellation_cdf(k, *moments)
+    assert np.abs(approx - exact).max() < 0.01
+
+    for q in (0.05, 0.1, 0.5, 0.9, 0.95):
+        quantile = portfolio.cancellation_quantile(q, *moments, n)
+        assert abs(int(quantile) - int(np.searchsorted(exact, q))) <= 1
+
+
+def _assert_same_summary(left, right):
+    a, b = left.summary(0.9), right.summary(0.9)
+    pd.testing.assert_index_equal(a.index, b.index)
+    np.testing.assert_allclose(a.to_numpy(dtype=float), b.to_numpy(dtype=float), atol=1e-9)
+
+
+def test_upsert_and_remove_match_a_full_rebuild(trained):
+    bookings = _bookings(600, seed=1)
+    as_of = "2017-07-01"
+    pf = portfolio.Portfolio(bookings.iloc[:400], trained, as_of=as_of)
+
+    changed = bookings.iloc[350:500].copy()
+    changed["lead_time"] += 30  # 350-399 se sustituyen, 400-499 son nuevas
+    changed.iloc[:10, changed.columns.get_loc("is_canceled")] = 1  # estas salen
+    pf.upsert(changed)
+    pf.remove(bookings.index[:50])
+
+    final = pd.concat([bookings.iloc[50:350], changed])
+    _assert_same_summary(pf, portfolio.Portfolio(final, trained, as_of=as_of))
+
+
+def test_refresh_matches_a_full_rebuild(trained, tmp_path):
+    bookings = _bookings(500, seed=2)
+    pf = portfolio.Portfolio(bookings, trained, as_of="2017-06-10")
+
+    # mismo modelo: solo se quitan las reservas que ya han llegado
+    pf.refresh(trained, as_of="2017-07-01")
+    _assert_same_summary(pf, portfolio.Portfolio(bookings, trained, as_of="2017-07-01"))
+
+    retrained = model.load_model(tmp_path / "other.csv", df=_bookings(3_000, seed=5))
+    pf.refresh(retrained, as_of="2017-07-15")
+
+    rebuilt = portfolio.Portfolio(bookings, retrained, as_of="2017-07-15")
+    _assert_same_summary(pf, rebuilt)
+    assert pf.summary().index.min() >= pd.Timestamp("2017-07-15")